@@ -1,25 +1,64 @@
 import os
 import sys
+import abc
+import argparse
+import atexit
 import base64
+import bisect
+import collections
+import errno
+import hashlib
+import heapq
+import importlib
+import io
 import logging
 import shutil
 import xml.etree.ElementTree as ET
-import tkinter as tk
-from tkinter import filedialog, ttk, messagebox
-from tkinter.scrolledtext import ScrolledText
-from pathlib import Path
 import threading
 import json
+import struct
+import zlib
 import datetime
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, IO, List, Tuple, Optional
 import re
 import concurrent.futures
+import contextlib
 from concurrent.futures import ThreadPoolExecutor
-import queue
-import traceback
 import time
-import socket
-import getpass
+import random
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access
+    
+    Keeps modules that only some start modes need (the GUI toolkit, the process
+    pool, archives, the metadata index, the metrics endpoint) out of startup.
+    """
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+
+tk = LazyModule("tkinter")
+ttk = LazyModule("tkinter.ttk")
+filedialog = LazyModule("tkinter.filedialog")
+messagebox = LazyModule("tkinter.messagebox")
+scrolledtext = LazyModule("tkinter.scrolledtext")
+csv = LazyModule("csv")
+getpass = LazyModule("getpass")
+http_server = LazyModule("http.server")
+multiprocessing = LazyModule("multiprocessing")
+socket = LazyModule("socket")
+sqlite3 = LazyModule("sqlite3")
+traceback = LazyModule("traceback")
+zipfile = LazyModule("zipfile")
 
 # Import fcntl for Unix systems
 if sys.platform != 'win32':
@@ -29,13 +68,77 @@ if sys.platform != 'win32':
         # fcntl not available on Windows
         pass
 
+# resource (peak memory reporting) is not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
 # Register XML namespaces
 NAMESPACES = {
     'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
     'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
-    # Add more namespaces as needed for different PEPPOL formats
+    'inv': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2',
+    'cn': 'urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2',
+    'ord': 'urn:oasis:names:specification:ubl:schema:xsd:Order-2',
+    'rsm': 'urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100',
+    'ram': 'urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100',
+    # Add more namespaces as needed for different PEPPOL formats (see FORMAT_PROFILES)
 }
 
+class HostIdentity:
+    """User and computer name, looked up in the background at startup
+    
+    getpass and hostname lookups can stall on misconfigured systems, so they
+    run on a daemon thread and callers only wait when they first need a name.
+    After one wait has timed out nobody waits again; UNKNOWN is returned until
+    the lookup finishes.
+    """
+    
+    UNKNOWN = "Nezināms"  # Unknown
+    WAIT_SECONDS = 5  # Longest a caller waits before falling back to UNKNOWN
+    
+    _lock = threading.Lock()
+    _thread = None
+    _ready = threading.Event()
+    _timed_out = False
+    _user = UNKNOWN
+    _pc = UNKNOWN
+    
+    @classmethod
+    def start(cls):
+        """Begin the lookup if it has not been started yet"""
+        with cls._lock:
+            if cls._thread is None:
+                cls._thread = threading.Thread(target=cls._resolve, name="host-identity", daemon=True)
+                cls._thread.start()
+    
+    @classmethod
+    def _resolve(cls):
+        for attr, getter in (("_user", lambda: getpass.getuser()), ("_pc", lambda: socket.gethostname())):
+            try:
+                setattr(cls, attr, getter())
+            except Exception:
+                pass  # Keep UNKNOWN
+        cls._ready.set()
+        logging.info(f"User: {cls._user}, PC: {cls._pc}")
+    
+    @classmethod
+    def ready(cls) -> bool:
+        """Tell whether the lookup has finished, without waiting"""
+        return cls._ready.is_set()
+    
+    @classmethod
+    def get(cls, timeout: Optional[float] = None) -> Tuple[str, str]:
+        """Return (user, pc), waiting up to timeout (default WAIT_SECONDS) if the lookup is still running"""
+        cls.start()
+        if not cls._timed_out and not cls._ready.wait(cls.WAIT_SECONDS if timeout is None else timeout):
+            cls._timed_out = True
+            logging.warning(f"User and PC name lookup is taking longer than {cls.WAIT_SECONDS} s, "
+                            f"logging them as '{cls.UNKNOWN}'")
+        return cls._user, cls._pc
+
+
 class ConfigManager:
     """Manages application configuration settings"""
     DEFAULT_CONFIG = {
@@ -45,15 +148,67 @@ class ConfigManager:
         "log_directory": "",
         "log_max_size_mb": 10,
         "log_max_lines": 10000,
-        "log_successful_files": False
+        "log_successful_files": False,
+        "stats_max_samples": 200,
+        "claim_input_files": True,
+        "claim_stale_seconds": 3600,
+        "durability_mode": "none",  # none, batch or strict
+        "output_mode": "files",  # files or zip
+        "archive_max_members": 10000,
+        "archive_max_mb": 512,
+        "metadata_index_path": "",  # SQLite file; empty disables the index
+        "metadata_fields": {},  # Field name -> cbc/cac path; empty uses DEFAULT_METADATA_FIELDS
+        "worker_threads_min": 1,
+        "worker_threads_max": 4,
+        "worker_processes_min": 0,
+        "worker_processes_max": 0,  # 0 keeps parsing and decoding in the worker threads
+        "autoscale_interval_files": 25,
+        "memory_budget_mb": 512,  # 0 disables admission control
+        "memory_estimate_factor": 2.5,  # Estimated peak memory per byte of XML
+        "batch_report_format": "jsonl",  # jsonl, csv or empty to keep no report
+        "batch_report_keep": 50,  # Newest batch reports kept in the log directory
+        "retry_max_attempts": 3,  # Retries for transient I/O errors before a file fails; 0 disables
+        "retry_base_seconds": 1.0,  # First retry delay, doubled on every further attempt
+        "retry_max_seconds": 30.0,
+        "metrics_textfile": "",  # .prom file for the node-exporter textfile collector; empty disables
+        "metrics_http_port": 0,  # Serve /metrics on this port; 0 disables
+        "metrics_http_host": "127.0.0.1",
+        "metrics_interval_seconds": 15,  # How often the textfile is rewritten
+        "startup_budget_ms": {"gui": 1500, "headless": 500},  # Limits checked by --startup-report
+        "pdf_optimize": False,  # Rewrite PDFs with pikepdf: object streams, deduplicated streams, linearised
+        "hot_folder_enabled": False,  # GUI: convert new files in the input directory in the background
+        "hot_folder_interval_seconds": 30,
+        "chunk_small_file_kb": 100,  # Files up to this size are grouped into process pool tasks; 0 disables
+        "chunk_max_files": 32,
+        "chunk_max_kb": 4096,
+        "output_collision": "suffix",  # overwrite, suffix, hash or skip_identical
+        "output_layout": "flat",  # flat, date, issue_date, supplier or hash subdirectories
+        "trace_directory": "",  # Record batch traces for --replay here; empty disables
+        "xml_parser": "auto",  # auto, etree, expat or lxml; auto uses lxml when installed
+        "xml_max_depth": 256,  # Deeper documents are rejected; 0 disables the check
+        "xml_forbid_entities": True,  # Reject documents that declare DTD entities
+        "log_async": True,  # Write the error log from a background thread
+        "log_queue_size": 1000,  # Entries held in memory before they spill to disk
+        "log_spill_file": ""  # Local spill file; empty uses one in the temp directory
     }
     
     def __init__(self, config_file: str = "config.json"):
         self.config_file = config_file
+        self._lock = threading.RLock()
+        self._stamp = None  # (mtime_ns, size) of the file the snapshot was loaded from
         self.config = self.load_config()
     
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        """Return (mtime_ns, size) of the config file, or None if it is missing"""
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    
     def load_config(self) -> Dict:
         """Load configuration from file or return default if file doesn't exist"""
+        self._stamp = self._file_stamp()
         if os.path.exists(self.config_file):
             try:
                 with open(self.config_file, 'r') as f:
@@ -63,15 +218,49 @@ class ConfigManager:
                 return self.DEFAULT_CONFIG.copy()
         return self.DEFAULT_CONFIG.copy()
     
+    def reload_if_changed(self) -> List[str]:
+        """Reload the snapshot if another instance rewrote the config file
+        
+        Costs a single stat when nothing changed, so callers can check once per
+        batch or scan instead of rereading the file for every lookup.
+        
+        Returns:
+            Keys whose values changed; empty if the file was not modified
+        """
+        with self._lock:
+            if self._file_stamp() == self._stamp:
+                return []
+            old = self.config
+            new = self.load_config()
+            self.config = new  # Readers see either the old or the new snapshot
+        changed = sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+        if changed:
+            logging.info(f"Configuration reloaded from {self.config_file}, changed: {', '.join(changed)}")
+        return changed
+    
     def save_config(self) -> bool:
-        """Save current configuration to file"""
-        try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.config, f, indent=4)
-            return True
-        except IOError as e:
-            logging.error(f"Error saving config: {str(e)}")
-            return False
+        """Save current configuration to file
+        
+        The file is written to a temporary name and renamed over the old one, so
+        other instances never read a half-written config.
+        """
+        with self._lock:
+            temp_file = f"{self.config_file}.{os.getpid()}.tmp"
+            try:
+                with open(temp_file, 'w') as f:
+                    json.dump(self.config, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_file, self.config_file)
+                self._stamp = self._file_stamp()
+                return True
+            except (IOError, OSError) as e:
+                logging.error(f"Error saving config: {str(e)}")
+                try:
+                    os.remove(temp_file)
+                except OSError:
+                    pass
+                return False
     
     def get(self, key: str, default=None):
         """Get configuration value by key"""
@@ -79,11 +268,270 @@ class ConfigManager:
     
     def set(self, key: str, value):
         """Set configuration value and save to file"""
-        # Convert directory paths to absolute paths
-        if key.endswith('_directory') and value:
-            value = os.path.abspath(value)
-        self.config[key] = value
-        return self.save_config()
+        return self.update({key: value})
+    
+    def update(self, values: Dict) -> bool:
+        """Set several configuration values with a single write
+        
+        Changes another instance saved since our last load are read first,
+        so only the given keys are overwritten. A lock file keeps instances
+        from interleaving their read and write.
+        """
+        with self._lock:
+            try:
+                lock_fd = os.open(f"{self.config_file}.lock", os.O_RDWR | os.O_CREAT, 0o666)
+            except OSError as e:
+                logging.warning(f"Could not lock config file: {str(e)}")
+                lock_fd = None
+            try:
+                if lock_fd is not None and 'fcntl' in globals():
+                    fcntl.lockf(lock_fd, fcntl.LOCK_EX)
+                self.reload_if_changed()
+                config = dict(self.config)
+                for key, value in values.items():
+                    # Convert directory paths to absolute paths
+                    if key.endswith('_directory') and value:
+                        value = os.path.abspath(value)
+                    config[key] = value
+                self.config = config
+                return self.save_config()
+            finally:
+                if lock_fd is not None:
+                    os.close(lock_fd)  # Releases the lock
+
+
+def try_lock_exclusive(file) -> bool:
+    """Take a non-blocking exclusive lock on an open file, held until the file is closed"""
+    try:
+        if 'fcntl' in globals():
+            fcntl.lockf(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            import msvcrt
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+class LogShipper:
+    """Delivers log records from a background thread so callers never wait on log I/O
+    
+    Records wait in a bounded in-memory queue. When the queue is full, or the
+    log share is down long enough for it to fill, records go to a local spill
+    file instead, and keep going there until the shipper has caught up, so
+    delivery order always matches submission order. A failed delivery is
+    retried with backoff and never dropped. Records still spilled when the
+    process exits are delivered first by the next run that gets the same file.
+    
+    Each shipper holds an exclusive lock on its spill file; when another
+    instance holds it, the next numbered file (.1, .2, ...) is used.
+    """
+    
+    RETRY_BASE_SECONDS = 1.0
+    RETRY_MAX_SECONDS = 60.0
+    SPILL_SLOTS = 16  # Numbered spill files tried before falling back to one per process
+    
+    _claimed = set()  # Spill files held by shippers in this process
+    _claimed_lock = threading.Lock()
+    
+    def __init__(self, deliver, max_queued: int, spill_path: str):
+        self.deliver = deliver  # Called with the submitted record's fields
+        self.max_queued = max(1, max_queued)
+        self.spill_path, self._spill_lock = self._claim_spill_file(spill_path)
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._spill_offset = 0  # Bytes of the spill file already delivered
+        self._spill_writer = None
+        self._closing = False
+        self._closed = False  # close() has taken over what is left
+        self.spilled = 0  # Records sent to the spill file, for diagnostics
+        try:
+            self._spilling = os.path.getsize(self.spill_path) > 0
+        except OSError:
+            self._spilling = False
+        if self._spilling:
+            logging.info(f"Delivering log records left in {self.spill_path} by an earlier run")
+        self._thread = threading.Thread(target=self._run, name="log-shipper", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    @classmethod
+    def _claim_spill_file(cls, base_path: str) -> Tuple[str, Optional[IO]]:
+        """Pick a spill file no other shipper is using
+        
+        Returns:
+            (spill path, open lock file to keep until close, or None)
+        """
+        root, ext = os.path.splitext(base_path)
+        with cls._claimed_lock:
+            for slot in range(cls.SPILL_SLOTS):
+                path = base_path if slot == 0 else f"{root}.{slot}{ext}"
+                if path in cls._claimed:
+                    continue
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    lock_file = open(path + ".lock", 'a+b')
+                except OSError as e:
+                    logging.warning(f"Could not lock log spill file {path}: {str(e)}")
+                    break
+                if try_lock_exclusive(lock_file):
+                    cls._claimed.add(path)
+                    return path, lock_file
+                lock_file.close()
+        # Unique to this process, so at least no other instance writes into it
+        return f"{root}.{os.getpid()}{ext}", None
+    
+    def _release_spill_file(self):
+        """Let another shipper use our spill file"""
+        if self._spill_lock:
+            self._spill_lock.close()
+            self._spill_lock = None
+            with LogShipper._claimed_lock:
+                LogShipper._claimed.discard(self.spill_path)
+    
+    def submit(self, record: Tuple):
+        """Queue a record for delivery; never blocks on the log destination"""
+        with self._condition:
+            if self._closing:
+                self._spill_locked(record)
+            elif self._spilling or len(self._queue) >= self.max_queued:
+                self._spilling = True
+                self._spill_locked(record)
+            else:
+                self._queue.append(record)
+            self._condition.notify()
+    
+    def _spill_locked(self, record: Tuple):
+        try:
+            if self._spill_writer is None:
+                os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+                self._spill_writer = open(self.spill_path, 'ab')
+            self._spill_writer.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+            self._spill_writer.flush()
+            self.spilled += 1
+        except OSError as e:
+            logging.error(f"Log record lost, spill file {self.spill_path} not writable: {str(e)}")
+    
+    def _next_spilled_locked(self) -> Tuple[Optional[Tuple], int]:
+        """Read the oldest undelivered spilled record and the offset after it"""
+        if self._spill_writer:
+            self._spill_writer.flush()
+        try:
+            with open(self.spill_path, 'rb') as f:
+                f.seek(self._spill_offset)
+                line = f.readline()
+                end = f.tell()
+        except FileNotFoundError:
+            line, end = b"", self._spill_offset
+        if not line.endswith(b"\n"):
+            return None, self._spill_offset
+        try:
+            return tuple(json.loads(line)), end
+        except ValueError:
+            return (), end  # Torn line from a crash: skip it
+    
+    def _caught_up_locked(self):
+        """All spilled records are delivered: empty the spill file and use the queue again"""
+        if self._spill_writer:
+            self._spill_writer.close()
+            self._spill_writer = None
+        try:
+            open(self.spill_path, 'wb').close()
+        except OSError as e:
+            logging.warning(f"Could not empty log spill file {self.spill_path}: {str(e)}")
+        self._spill_offset = 0
+        self._spilling = False
+    
+    def _run(self):
+        attempt = 0
+        while True:
+            with self._condition:
+                while not self._queue and not self._spilling and not self._closing:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                if self._queue:
+                    # Queued records are always older than spilled ones
+                    record, from_spill = self._queue[0], False
+                elif self._spilling:
+                    record, end = self._next_spilled_locked()
+                    if record is None:
+                        self._caught_up_locked()
+                        continue
+                    from_spill = True
+                else:
+                    return
+            
+            if record:
+                try:
+                    self.deliver(*record)
+                except Exception as e:
+                    attempt += 1
+                    if attempt == 1:
+                        logging.warning(f"Log destination unavailable, holding log records: {str(e)}")
+                    with self._condition:
+                        if self._closing:
+                            return
+                        self._condition.wait(retry_delay(attempt, self.RETRY_BASE_SECONDS, self.RETRY_MAX_SECONDS))
+                    continue
+                if attempt:
+                    logging.info(f"Log destination available again after {attempt} failed attempts")
+                    attempt = 0
+            
+            with self._condition:
+                if self._closed:
+                    return
+                if from_spill:
+                    self._spill_offset = end
+                else:
+                    self._queue.popleft()
+                self._condition.notify_all()
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted record is delivered; False if the timeout passed first"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queue and not self._spilling, timeout)
+    
+    def close(self, timeout: float = 5.0):
+        """Deliver what can be delivered within the timeout and keep the rest in the spill file"""
+        if self._closing:
+            return
+        self.flush(timeout)
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        with self._condition:
+            self._closed = True
+            if self._spill_writer:
+                self._spill_writer.close()
+                self._spill_writer = None
+            if not self._queue and not self._spill_offset:
+                self._release_spill_file()
+                return
+            # Rewrite the spill file as: undelivered queue records (the oldest), then unread spilled ones
+            remaining = b""
+            if self._spilling:
+                try:
+                    with open(self.spill_path, 'rb') as f:
+                        f.seek(self._spill_offset)
+                        remaining = f.read()
+                except FileNotFoundError:
+                    pass
+            temp_file = f"{self.spill_path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+                with open(temp_file, 'wb') as f:
+                    for record in self._queue:
+                        f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+                    f.write(remaining)
+                os.replace(temp_file, self.spill_path)
+            except OSError as e:
+                logging.error(f"Could not keep {len(self._queue)} undelivered log records: {str(e)}")
+            self._queue.clear()
+            self._spill_offset = 0
+            self._release_spill_file()
 
 
 class LogManager:
@@ -96,28 +544,38 @@ class LogManager:
         self.MAX_LOG_RECORDS = self.config.get("log_max_lines", 10000)  # Default max number of records in log file
         self.LOG_SUCCESS = self.config.get("log_successful_files", False)  # Whether to log successful conversions
         self.log_record_count = 0  # Current record count in log file
-        
-        # Get user and PC information
-        self.username = self._get_username()
-        self.pc_name = self._get_pc_name()
+        self._lock = threading.Lock()  # Serialises writes and rotation across workers
         
         self.setup_logging()
+        
+        # User and PC information is resolved in the background, see HostIdentity
+        HostIdentity.start()
+        
+        # Entries are written by a background thread unless log_async is off
+        self.shipper = None
+        if self.config.get("log_async", True):
+            self.shipper = LogShipper(self._write_entry, self.config.get("log_queue_size", 1000),
+                                      self.spill_path())
     
-    def _get_username(self):
-        """Get current username"""
-        try:
-            import getpass
-            return getpass.getuser()
-        except:
-            return "Nezināms"  # Unknown
+    def spill_path(self) -> str:
+        """Local file holding log records the log directory could not take yet"""
+        spill_file = self.config.get("log_spill_file", "")
+        if spill_file:
+            return os.path.abspath(spill_file)
+        # One spill file per log file, on local disk
+        import tempfile
+        key = hashlib.sha1(os.path.abspath(self.LOG_FILE).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(tempfile.gettempdir(), f"xmltopdf_log_spill_{key}.jsonl")
     
-    def _get_pc_name(self):
-        """Get computer name"""
-        try:
-            import socket
-            return socket.gethostname()
-        except:
-            return "Nezināms"  # Unknown
+    @property
+    def username(self):
+        """Current username"""
+        return HostIdentity.get()[0]
+    
+    @property
+    def pc_name(self):
+        """Computer name"""
+        return HostIdentity.get()[1]
     
     def setup_logging(self):
         """Configure logging based on current settings"""
@@ -139,7 +597,6 @@ class LogManager:
         root_logger.addHandler(console_handler)
         
         logging.info(f"Logging initialized. Log file: {self.LOG_FILE}")
-        logging.info(f"User: {self.username}, PC: {self.pc_name}")
 
     def update_log_path(self):
         """Update log file path based on current config"""
@@ -153,98 +610,81 @@ class LogManager:
     
     def log_error(self, file_name, error_message):
         """Log an error with the standard format"""
-        # Check if we need to create a new log file
-        new_log_file = self.LOG_FILE
-        
-        if os.path.exists(self.LOG_FILE):
-            # Check file size
-            file_size_mb = os.path.getsize(self.LOG_FILE) / (1024 * 1024)  # Convert to MB
-            
-            # Count records in file
-            if self.log_record_count == 0:  # Only count if we haven't already
-                with open(self.LOG_FILE, 'r', encoding='utf-8') as f:
-                    self.log_record_count = sum(1 for line in f if line.startswith("Ielādes datums:"))
-            
-            # If either limit is exceeded, create a new log file
-            if file_size_mb >= self.MAX_LOG_SIZE or self.log_record_count >= self.MAX_LOG_RECORDS:
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                log_dir = os.path.dirname(self.LOG_FILE)
-                log_name = os.path.basename(self.LOG_FILE)
-                base_name, ext = os.path.splitext(log_name)
-                new_log_file = os.path.join(log_dir, f"{base_name}_{timestamp}{ext}")
-                self.log_record_count = 0  # Reset count for new file
-        
-        # Format the error log entry
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = (
-            f"Ielādes datums: {timestamp}\n"
-            f"Lietotājs: {self.username}\n"
-            f"Dators: {self.pc_name}\n"
-            f"Statuss: KĻŪDA\n"
-            f"Faila nosaukums: {file_name}\n"
-            f"KĻŪDAS APRAKSTS/PIEZĪMES: {error_message}\n"
-            f"{'='*50}\n\n"
-        )
-        
-        # Write to log file
-        os.makedirs(os.path.dirname(new_log_file), exist_ok=True)
-        with open(new_log_file, "a", encoding="utf-8") as log:
-            log.write(log_entry)
-        
-        # Update record count
-        self.log_record_count += 1
-        
-        # If we created a new file, update the LOG_FILE path
-        if new_log_file != self.LOG_FILE:
-            self.LOG_FILE = new_log_file
+        self._submit("KĻŪDA", file_name, error_message)
     
     def log_success(self, file_name):
         """Log a successful conversion"""
         # Only log if LOG_SUCCESS is enabled
         if not self.LOG_SUCCESS:
             return
+        self._submit("VEIKSMĪGI", file_name, "-")
+    
+    def _submit(self, status, file_name, notes):
+        """Hand an entry to the shipper, stamped with the time of the event"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self.shipper:
+            self.shipper.submit((timestamp, status, file_name, notes))
+        else:
+            self._write_entry(timestamp, status, file_name, notes)
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until queued entries are written; False if the timeout passed first"""
+        return self.shipper.flush(timeout) if self.shipper else True
+    
+    def close(self):
+        """Write queued entries and stop the shipper, spilling what the log directory cannot take"""
+        if self.shipper:
+            self.shipper.close()
+    
+    def _write_entry(self, timestamp, status, file_name, notes):
+        """Append one record to the log file, rotating it when a limit is exceeded"""
+        # Batches may run several workers, and rotation must see a consistent count
+        with self._lock:
+            # Check if we need to create a new log file
+            new_log_file = self.LOG_FILE
             
-        # Check if we need to create a new log file (same as in log_error)
-        new_log_file = self.LOG_FILE
-        
-        if os.path.exists(self.LOG_FILE):
-            file_size_mb = os.path.getsize(self.LOG_FILE) / (1024 * 1024)
+            if os.path.exists(self.LOG_FILE):
+                # Check file size
+                file_size_mb = os.path.getsize(self.LOG_FILE) / (1024 * 1024)  # Convert to MB
+                
+                # Count records in file
+                if self.log_record_count == 0:  # Only count if we haven't already
+                    with open(self.LOG_FILE, 'r', encoding='utf-8') as f:
+                        self.log_record_count = sum(1 for line in f if line.startswith("Ielādes datums:"))
+                
+                # If either limit is exceeded, create a new log file
+                if file_size_mb >= self.MAX_LOG_SIZE or self.log_record_count >= self.MAX_LOG_RECORDS:
+                    # A separate name: timestamp is the entry's own time
+                    suffix = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                    log_dir = os.path.dirname(self.LOG_FILE)
+                    log_name = os.path.basename(self.LOG_FILE)
+                    base_name, ext = os.path.splitext(log_name)
+                    new_log_file = os.path.join(log_dir, f"{base_name}_{suffix}{ext}")
+                    self.log_record_count = 0  # Reset count for new file
             
-            if self.log_record_count == 0:
-                with open(self.LOG_FILE, 'r', encoding='utf-8') as f:
-                    self.log_record_count = sum(1 for line in f if line.startswith("Ielādes datums:"))
+            # Format the log entry
+            user, pc = HostIdentity.get()
+            log_entry = (
+                f"Ielādes datums: {timestamp}\n"
+                f"Lietotājs: {user}\n"
+                f"Dators: {pc}\n"
+                f"Statuss: {status}\n"
+                f"Faila nosaukums: {file_name}\n"
+                f"KĻŪDAS APRAKSTS/PIEZĪMES: {notes}\n"
+                f"{'='*50}\n\n"
+            )
             
-            if file_size_mb >= self.MAX_LOG_SIZE or self.log_record_count >= self.MAX_LOG_RECORDS:
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                log_dir = os.path.dirname(self.LOG_FILE)
-                log_name = os.path.basename(self.LOG_FILE)
-                base_name, ext = os.path.splitext(log_name)
-                new_log_file = os.path.join(log_dir, f"{base_name}_{timestamp}{ext}")
-                self.log_record_count = 0
-        
-        # Format the success log entry
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = (
-            f"Ielādes datums: {timestamp}\n"
-            f"Lietotājs: {self.username}\n"
-            f"Dators: {self.pc_name}\n"
-            f"Statuss: VEIKSMĪGI\n"
-            f"Faila nosaukums: {file_name}\n"
-            f"KĻŪDAS APRAKSTS/PIEZĪMES: -\n"
-            f"{'='*50}\n\n"
-        )
-        
-        # Write to log file
-        os.makedirs(os.path.dirname(new_log_file), exist_ok=True)
-        with open(new_log_file, "a", encoding="utf-8") as log:
-            log.write(log_entry)
-        
-        # Update record count
-        self.log_record_count += 1
-        
-        # If we created a new file, update the LOG_FILE path
-        if new_log_file != self.LOG_FILE:
-            self.LOG_FILE = new_log_file
+            # Write to log file
+            os.makedirs(os.path.dirname(new_log_file), exist_ok=True)
+            with open(new_log_file, "a", encoding="utf-8") as log:
+                log.write(log_entry)
+            
+            # Update record count
+            self.log_record_count += 1
+            
+            # If we created a new file, update the LOG_FILE path
+            if new_log_file != self.LOG_FILE:
+                self.LOG_FILE = new_log_file
     
     def update_config(self, log_max_size_mb, log_max_lines, log_successful_files):
         """Update logger configuration"""
@@ -253,13 +693,133 @@ class LogManager:
         self.LOG_SUCCESS = log_successful_files
 
 class DirectoryLockManager:
-    """Manages directory locking to prevent multiple users from using the same directory"""
+    """Tracks which users are working in a directory through a compact presence registry
+    
+    The .dirtracker file holds one fixed-size record per user/host. Records are
+    refreshed in place by a periodic heartbeat, stale slots are reused, and
+    trailing free slots are trimmed, so the file never grows beyond the number
+    of concurrently active users.
+    """
+    TRACKER_NAME = ".dirtracker"
+    RECORD_SIZE = 128  # Bytes per record, including the trailing newline
+    HEARTBEAT_SECONDS = 300
+    ACTIVE_SECONDS = 3 * HEARTBEAT_SECONDS  # Records older than this are free
     
     def __init__(self):
-        self.locks = {}  # Keep track of lock files we've created
+        self.locks = {}  # Keep track of tracker files we've registered in
+        self._registry_lock = threading.Lock()  # Keeps heartbeats from re-adding released records
+        self._heartbeat_stop = None
+        self._heartbeat_thread = None
+        HostIdentity.start()
+    
+    def start_heartbeat(self, directories: Tuple[str, ...] = ()):
+        """Refresh our records from a background thread, for callers without a GUI timer
+        
+        Long batches would otherwise let the records go stale while the
+        directories are still in use. The given directories are registered
+        first, on the same thread, so a slow user/PC lookup does not hold up
+        the caller; the outcome is logged.
+        """
+        if self._heartbeat_stop is not None:
+            return
+        self._heartbeat_stop = threading.Event()
+        
+        def run(stop):
+            for directory in directories:
+                if stop.is_set():
+                    return
+                success, msg = self.try_lock_directory(directory)
+                if msg:
+                    logging.info(msg)
+            while not stop.wait(self.HEARTBEAT_SECONDS):
+                self.heartbeat()
+        
+        self._heartbeat_thread = threading.Thread(target=run, args=(self._heartbeat_stop,),
+                                                  name="directory-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+    
+    @staticmethod
+    def _identity() -> Tuple[str, str]:
+        """(user, pc) for our record, stripped of the record separators"""
+        user, pc = HostIdentity.get()
+        return user.replace('\t', ' ').replace('\n', ' '), pc.replace('\t', ' ').replace('\n', ' ')
+    
+    def _encode_record(self, identity: Tuple[str, str], timestamp: float) -> bytes:
+        """Encode our own presence record padded to RECORD_SIZE"""
+        record = f"{identity[0]}\t{identity[1]}\t{timestamp:.0f}".encode('utf-8')[:self.RECORD_SIZE - 1]
+        return record.ljust(self.RECORD_SIZE - 1) + b"\n"
+    
+    def _decode_records(self, data: bytes) -> List[Optional[Tuple[str, str, float]]]:
+        """Split tracker contents into records; free or unreadable slots become None"""
+        records = []
+        for offset in range(0, len(data) - len(data) % self.RECORD_SIZE, self.RECORD_SIZE):
+            parts = data[offset:offset + self.RECORD_SIZE].decode('utf-8', 'replace').strip().split('\t')
+            try:
+                records.append((parts[0], parts[1], float(parts[2])))
+            except (IndexError, ValueError):
+                records.append(None)
+        return records
+    
+    def _update_registry(self, directory: str, present: bool) -> List[Tuple[str, str]]:
+        """Write or clear our record in a directory's tracker file
+        
+        Args:
+            directory: Directory whose tracker to update
+            present: True to refresh our record, False to free it
+            
+        Returns:
+            List of (user, pc) for the other active users
+        """
+        tracker_path = os.path.join(directory, self.TRACKER_NAME)
+        identity = self._identity()  # Resolved before taking the file lock
+        fd = os.open(tracker_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if 'fcntl' in globals():
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+            
+            size = os.fstat(fd).st_size
+            data = os.pread(fd, size, 0) if hasattr(os, 'pread') else os.read(fd, size)
+            if size % self.RECORD_SIZE:
+                data = b""  # Legacy append-style tracker: start over
+            records = self._decode_records(data)
+            
+            now = time.time()
+            own_slot = None
+            free_slot = None
+            others = []
+            for slot, record in enumerate(records):
+                if record is None or now - record[2] >= self.ACTIVE_SECONDS:
+                    records[slot] = None
+                    if free_slot is None:
+                        free_slot = slot
+                elif (record[0], record[1]) == identity:
+                    own_slot = slot
+                else:
+                    others.append((record[0], record[1]))
+            
+            if present:
+                slot = own_slot if own_slot is not None else free_slot
+                if slot is None:
+                    slot = len(records)
+                    records.append(None)
+                records[slot] = (identity[0], identity[1], now)
+                os.lseek(fd, slot * self.RECORD_SIZE, os.SEEK_SET)
+                os.write(fd, self._encode_record(identity, now))
+            elif own_slot is not None:
+                records[own_slot] = None
+            
+            # Prune free slots at the end of the file; blank interior free slots in place
+            used = len(records)
+            while used and records[used - 1] is None:
+                used -= 1
+            os.ftruncate(fd, used * self.RECORD_SIZE)
+            if own_slot is not None and not present and own_slot < used:
+                os.lseek(fd, own_slot * self.RECORD_SIZE, os.SEEK_SET)
+                os.write(fd, b" " * (self.RECORD_SIZE - 1) + b"\n")
+            return others
+        finally:
+            os.close(fd)  # Closing the descriptor also drops the lock
     
-    # In the DirectoryLockManager class, change try_lock_directory method:
-
     def try_lock_directory(self, directory):
         """
         Track directory usage without preventing access
@@ -272,39 +832,13 @@ class DirectoryLockManager:
         """
         if not directory or not os.path.exists(directory):
             return True, ""  # Directory doesn't exist
-            
-        lock_file_path = os.path.join(directory, ".dirtracker")
-        
-        # Check if tracker file exists and read it
-        current_users = []
-        if os.path.exists(lock_file_path):
-            try:
-                with open(lock_file_path, 'r') as f:
-                    for line in f:
-                        parts = line.strip().split(',')
-                        if len(parts) >= 3:
-                            user, pc, timestamp = parts[0], parts[1], float(parts[2])
-                            # Only include active users (within the last hour)
-                            if time.time() - timestamp < 3600:  # 1 hour in seconds
-                                current_users.append((user, pc))
-            except Exception as e:
-                logging.warning(f"Error reading tracker file: {str(e)}")
         
-        # Add current user information
         try:
-            user = getpass.getuser()
-            pc = socket.gethostname()
-            timestamp = time.time()
-            
-            # Create a new entry for this user
-            new_entry = f"{user},{pc},{timestamp}\n"
-            
-            # Write to tracker file, appending our info
-            with open(lock_file_path, 'a') as f:
-                f.write(new_entry)
-            
-            # Keep track of this tracker file
-            self.locks[directory] = lock_file_path
+            with self._registry_lock:
+                current_users = self._update_registry(directory, present=True)
+                
+                # Keep track of this tracker file
+                self.locks[directory] = os.path.join(directory, self.TRACKER_NAME)
             
             if current_users:
                 user_info = ", ".join([f"{u} ({p})" for u, p in current_users])
@@ -316,17 +850,28 @@ class DirectoryLockManager:
             logging.error(f"Error updating tracker file: {str(e)}")
             return True, f"Neizdevās atjaunināt lietotāju informāciju direktorijam '{directory}': {str(e)}"
     
+    def heartbeat(self):
+        """Refresh our record in every directory we are registered in"""
+        for directory in list(self.locks.keys()):
+            try:
+                with self._registry_lock:
+                    if directory in self.locks:
+                        self._update_registry(directory, present=True)
+            except Exception as e:
+                logging.warning(f"Error refreshing tracker file in {directory}: {str(e)}")
+    
     def release_directory_lock(self, directory):
         """
-        Release a previously acquired directory lock
+        Remove our record from a directory's tracker, leaving other users' records intact
         
         Args:
             directory: Path to the directory to unlock
         """
-        if directory in self.locks and os.path.exists(self.locks[directory]):
+        if directory in self.locks:
             try:
-                os.remove(self.locks[directory])
-                del self.locks[directory]
+                with self._registry_lock:
+                    self._update_registry(directory, present=False)
+                    del self.locks[directory]
                 return True
             except Exception as e:
                 logging.error(f"Error releasing lock: {str(e)}")
@@ -335,280 +880,3264 @@ class DirectoryLockManager:
     
     def release_all_locks(self):
         """Release all directory locks on application exit"""
+        if self._heartbeat_stop is not None:
+            self._heartbeat_stop.set()
+            self._heartbeat_stop = None
+            # A registration still in progress must finish before its record can be released
+            self._heartbeat_thread.join(HostIdentity.WAIT_SECONDS + 1)
+            self._heartbeat_thread = None
         for directory in list(self.locks.keys()):
             self.release_directory_lock(directory)
 
 
-class PeppolConverter:
-    """Converts PEPPOL XML files with embedded PDFs to standalone PDF files"""
+class FileClaimer:
+    """Partitions the files of a shared input directory between converter instances
     
-    def __init__(self, config_manager: ConfigManager):
-        self.config = config_manager
-        self.log_manager = None  # Will be set externally
-        self.stats = {
-            "processed": 0,
-            "success": 0,
-            "failed": 0,
-            "start_time": datetime.datetime.now()
-        }
+    A file is claimed by renaming it into this instance's own subdirectory of
+    .claims. Rename is atomic within one filesystem, so exactly one instance
+    wins each file no matter how many machines watch the same share.
+    """
+    CLAIMS_DIR = ".claims"
+    HEARTBEAT_SECONDS = 60
     
-    def set_log_manager(self, log_manager):
-        """Set the log manager instance"""
-        self.log_manager = log_manager
-
-    def _move_to_failed_dir(self, xml_file, error_msg):
-        """Move a file to the failed directory and return appropriate response tuple"""
-        filename = os.path.basename(xml_file)
+    def __init__(self, directory: str, stale_seconds: float = 3600):
+        self.directory = os.path.abspath(directory)
+        self.stale_seconds = stale_seconds
+        owner = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{socket.gethostname()}_{os.getpid()}")
+        self.claims_root = os.path.join(self.directory, self.CLAIMS_DIR)
+        self.claim_dir = os.path.join(self.claims_root, owner)
+        os.makedirs(self.claim_dir, exist_ok=True)
+        self.last_heartbeat = time.time()
+    
+    def owns(self, path: str) -> bool:
+        """Check whether a file lives directly in the shared input directory"""
+        return os.path.dirname(os.path.abspath(path)) == self.directory
+    
+    def heartbeat(self):
+        """Refresh the claim directory's mtime so other instances see we are alive"""
+        self.last_heartbeat = time.time()
+        try:
+            # Another instance may have taken us for dead and removed the directory
+            os.makedirs(self.claim_dir, exist_ok=True)
+            os.utime(self.claim_dir)
+        except OSError as e:
+            logging.warning(f"Failed to refresh claim heartbeat: {str(e)}")
+    
+    def heartbeat_if_due(self):
+        """Heartbeat unless one was sent within HEARTBEAT_SECONDS; called by idle watch loops"""
+        if time.time() - self.last_heartbeat > self.HEARTBEAT_SECONDS:
+            self.heartbeat()
+    
+    def claim(self, path: str) -> Optional[str]:
+        """Atomically take ownership of a file
         
-        # Log the error
-        logging.error(error_msg)
-        if self.log_manager:
-            self.log_manager.log_error(filename, error_msg)
+        Returns:
+            Path of the claimed file, or None if another instance got it first
+        """
+        self.heartbeat_if_due()
+        claimed_path = os.path.join(self.claim_dir, os.path.basename(path))
+        try:
+            os.rename(path, claimed_path)
+        except FileNotFoundError:
+            if not os.path.exists(path):
+                return None  # Claimed elsewhere
+            # The source is still there, so our claim directory is gone: recreate it once
+            os.makedirs(self.claim_dir, exist_ok=True)
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                return None
+        return claimed_path
+    
+    def release(self, claimed_path: str):
+        """Return a claimed file to the shared input directory unprocessed"""
+        try:
+            os.rename(claimed_path, os.path.join(self.directory, os.path.basename(claimed_path)))
+        except FileNotFoundError:
+            pass
+    
+    def recover_stale_claims(self) -> int:
+        """Return files held by instances that stopped heartbeating to the input directory
         
-        # Move to failed directory if configured
-        if os.path.exists(xml_file):
-            failed_dir = self.config.get("failed_directory")
-            if failed_dir:
-                failed_dir = os.path.abspath(failed_dir)
-                os.makedirs(failed_dir, exist_ok=True)
-                
-                try:
-                    failed_path = os.path.join(failed_dir, filename)
-                    shutil.move(xml_file, failed_path)
-                    logging.info(f"Moved failed file to: {failed_path}")
-                except Exception as move_err:
-                    logging.error(f"Failed to move failed file: {str(move_err)}")
+        Returns:
+            Number of files recovered
+        """
+        recovered = 0
+        try:
+            entries = list(os.scandir(self.claims_root))
+        except FileNotFoundError:
+            return 0
+        
+        now = time.time()
+        for entry in entries:
+            if not entry.is_dir() or entry.path == self.claim_dir:
+                continue
+            try:
+                if now - entry.stat().st_mtime < self.stale_seconds:
+                    continue
+                for claimed in os.scandir(entry.path):
                     try:
-                        shutil.copy2(xml_file, os.path.join(failed_dir, filename))
-                        logging.info(f"Copied failed file to: {failed_dir} (move failed)")
-                    except Exception as copy_err:
-                        logging.error(f"Failed to copy failed file as fallback: {str(copy_err)}")
+                        os.rename(claimed.path, os.path.join(self.directory, claimed.name))
+                        recovered += 1
+                    except FileNotFoundError:
+                        pass  # Another instance recovered it first
+                os.rmdir(entry.path)
+            except OSError as e:
+                logging.warning(f"Failed to recover stale claims in {entry.path}: {str(e)}")
         
-        return False, error_msg
+        if recovered:
+            logging.info(f"Recovered {recovered} files from stale claims in {self.directory}")
+        return recovered
     
-    def process_file(self, xml_file: str) -> Tuple[bool, str]:
-        """Process a single XML file to extract embedded PDF
+    def close(self):
+        """Release any files still claimed and remove our claim directory"""
+        try:
+            for claimed in os.scandir(self.claim_dir):
+                self.release(claimed.path)
+            os.rmdir(self.claim_dir)
+        except OSError as e:
+            logging.warning(f"Failed to clean up claim directory {self.claim_dir}: {str(e)}")
+
+
+class ConversionError(Exception):
+    """Raised when an invoice cannot be converted, tagged with an error category"""
+    
+    def __init__(self, message: str, category: str):
+        super().__init__(message)
+        self.category = category
+    
+    def __reduce__(self):
+        # Keep the category when the error crosses a process pool boundary
+        return (ConversionError, (str(self), self.category))
+
+
+RETRY_CATEGORY = "retry"  # Returned instead of an error category when a file should be retried
+
+
+def classify_error(error: Exception) -> str:
+    """Map an exception raised while processing a file to an error category"""
+    if isinstance(error, ConversionError):
+        return error.category
+    if isinstance(error, ET.ParseError):
+        return "xml"
+    if isinstance(error, OSError):
+        return "io"
+    return "unexpected"
+
+
+BATCH_REPORT_FORMATS = ("jsonl", "csv")
+
+
+class BatchReport:
+    """Streams every file outcome of a batch to disk as it completes
+    
+    Successes and failures go to separate files, so the summary window can page
+    through either one. The byte offset of every PAGE_SIZE-th record is kept,
+    letting read_page seek straight to a page instead of scanning the file.
+    
+    The report lives in the log directory, which may be a slow or unavailable
+    share. A write error is logged once and ends the report for the rest of
+    the batch; it never reaches the conversion.
+    """
+    
+    PAGE_SIZE = 100
+    CSV_HEADER = ("file", "message", "category")
+    
+    def __init__(self, directory: str, report_format: str = "jsonl"):
+        if report_format not in BATCH_REPORT_FORMATS:
+            raise ValueError(f"Unknown batch report format: {report_format}")
+        self.directory = directory
+        self.format = report_format
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        self.paths = {}
+        self.offsets = {}  # Outcome -> byte offset of every PAGE_SIZE-th record
+        self.counts = {}
+        self._files = {}
+        self.error = None  # Why the report stopped early, if it did
+        for outcome in ("success", "failed"):
+            path = os.path.join(directory, f"batch_{timestamp}_{outcome}.{report_format}")
+            handle = open(path, "wb")
+            if report_format == "csv":
+                handle.write(self._format_csv(self.CSV_HEADER))
+            self.paths[outcome] = path
+            self.offsets[outcome] = []
+            self.counts[outcome] = 0
+            self._files[outcome] = handle
+    
+    @staticmethod
+    def _format_csv(row) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow(row)
+        return buffer.getvalue().encode("utf-8")
+    
+    def record(self, outcome: str, filename: str, message: str, category: str = ""):
+        """Append one result to the success or failed report"""
+        if self.format == "csv":
+            line = self._format_csv((filename, message, category))
+        else:
+            line = (json.dumps({"file": filename, "message": message, "category": category},
+                               ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            handle = self._files.get(outcome)
+            if handle is None:
+                return  # Report already closed
+            try:
+                offset = handle.tell()
+                handle.write(line)
+            except OSError as e:
+                self._abandon_locked(e)
+                return
+            if self.counts[outcome] % self.PAGE_SIZE == 0:
+                self.offsets[outcome].append(offset)
+            self.counts[outcome] += 1
+    
+    def _abandon_locked(self, error: OSError):
+        """Stop writing the report after an I/O error, keeping what was written"""
+        self.error = str(error)
+        logging.error(f"Batch report in {self.directory} stopped, results are no longer recorded: {self.error}")
+        self._close_files_locked()
+    
+    def _close_files_locked(self):
+        for handle in self._files.values():
+            try:
+                handle.close()
+            except OSError as e:
+                if self.error is None:
+                    self.error = str(e)
+                    logging.error(f"Failed to finish batch report in {self.directory}: {self.error}")
+        self._files = {}
+    
+    def close(self):
+        """Flush and close the report files"""
+        with self._lock:
+            self._close_files_locked()
+    
+    def info(self) -> Dict:
+        """Describe the report for the batch statistics, see read_page"""
+        return {
+            "format": self.format,
+            "page_size": self.PAGE_SIZE,
+            "paths": dict(self.paths),
+            "offsets": {outcome: list(offsets) for outcome, offsets in self.offsets.items()},
+            "counts": dict(self.counts),
+            "error": self.error
+        }
+    
+    @staticmethod
+    def page_count(report_info: Dict, outcome: str) -> int:
+        """Number of pages in one outcome of a report"""
+        return len(report_info["offsets"][outcome])
+    
+    @staticmethod
+    def read_page(report_info: Dict, outcome: str, page: int) -> List[Tuple[str, str, str]]:
+        """Read one page of (file, message, category) records from a closed report
         
+        Args:
+            report_info: Dict returned by info()
+            outcome: "success" or "failed"
+            page: Zero-based page number
+            
         Returns:
-            Tuple[bool, str]: (success, message)
+            Up to page_size records; empty when the page does not exist
         """
+        offsets = report_info["offsets"][outcome]
+        if page < 0 or page >= len(offsets):
+            return []
+        page_size = report_info["page_size"]
+        records = []
+        with open(report_info["paths"][outcome], "rb") as f:
+            f.seek(offsets[page])
+            if report_info["format"] == "csv":
+                reader = csv.reader(io.TextIOWrapper(f, encoding="utf-8", newline=""))
+                for row in reader:
+                    records.append(tuple(row[:3]))
+                    if len(records) >= page_size:
+                        break
+            else:
+                for line in f:
+                    entry = json.loads(line)
+                    records.append((entry["file"], entry["message"], entry.get("category", "")))
+                    if len(records) >= page_size:
+                        break
+        return records
+    
+    @staticmethod
+    def prune(directory: str, keep: int):
+        """Delete all but the newest keep batch reports in a directory"""
         try:
-            filename = os.path.basename(xml_file)
-            
-            # Standard logging for console
-            logging.info(f"Processing {filename}")
-            
-            # Parse XML
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            
-            # Register namespaces for XPath
-            for prefix, uri in NAMESPACES.items():
-                ET.register_namespace(prefix, uri)
-            
-            # Find embedded document node using XPath-like search
-            embedded_doc = None
-            for elem in root.iter():
-                if elem.tag.endswith('EmbeddedDocumentBinaryObject'):
-                    embedded_doc = elem
-                    break
-            
-            if embedded_doc is None:
-                error_msg = "Dokumentā nav atrasts iegultais PDF fails"  
-                return self._move_to_failed_dir(xml_file, error_msg)
+            names = [name for name in os.listdir(directory) if name.startswith("batch_")]
+        except OSError:
+            return
+        # Both outcome files of a batch share the timestamp prefix
+        batches = sorted({name.rsplit("_", 1)[0] for name in names}, reverse=True)
+        for stale in batches[keep:]:
+            for name in names:
+                if name.startswith(stale + "_"):
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError as e:
+                        logging.warning(f"Could not remove old batch report {name}: {str(e)}")
+
+
+# errno values that a network share or a busy file produce and that usually clear on their own
+TRANSIENT_ERRNOS = frozenset(
+    code for code in (getattr(errno, name, None) for name in (
+        "EAGAIN", "EWOULDBLOCK", "EBUSY", "EINTR", "ETIMEDOUT", "ESTALE", "ECONNRESET",
+        "ECONNABORTED", "ECONNREFUSED", "ENETDOWN", "ENETUNREACH", "ENETRESET",
+        "EHOSTDOWN", "EHOSTUNREACH", "ENOLCK", "EREMOTEIO"))
+    if code is not None
+)
+
+# Windows error codes for sharing violations and lost network connections
+TRANSIENT_WINERRORS = frozenset((
+    32,    # ERROR_SHARING_VIOLATION
+    33,    # ERROR_LOCK_VIOLATION
+    53,    # ERROR_BAD_NETPATH
+    59,    # ERROR_UNEXP_NET_ERR
+    64,    # ERROR_NETNAME_DELETED
+    121,   # ERROR_SEM_TIMEOUT
+    1231,  # ERROR_NETWORK_UNREACHABLE
+))
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Tell whether an error is worth retrying, e.g. a share that briefly went away
+    
+    Conversion errors (bad XML, missing attachment, bad base64) are permanent.
+    """
+    if not isinstance(error, OSError):
+        return False
+    winerror = getattr(error, "winerror", None)
+    if winerror is not None:
+        return winerror in TRANSIENT_WINERRORS
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return error.errno in TRANSIENT_ERRNOS
+
+
+def retry_delay(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    """Exponential backoff with jitter for the given retry attempt (1-based)
+    
+    Half of the delay is fixed and half random, so files that failed together
+    do not all hit the share again at the same moment.
+    """
+    delay = min(max_seconds, base_seconds * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class BatchStats:
+    """Collects batch results in per-worker counters that are merged at the end
+    
+    Every thread that records a result gets its own counters, so workers never
+    write to shared state. Only the first max_samples file names are kept per
+    outcome; totals and per-category failure counts are always exact. With a
+    BatchReport every result is also streamed to disk, and with metrics every
+    result also updates the process-wide counters.
+    """
+    
+    def __init__(self, max_samples: int = 200, report: Optional[BatchReport] = None, metrics=None):
+        self.max_samples = max_samples
+        self.report = report
+        self.metrics = metrics
+        self._local = threading.local()
+        self._workers = []  # Counters of every worker that has recorded something
+    
+    def _counters(self) -> Dict:
+        """Return the calling thread's counters, creating them on first use"""
+        counters = getattr(self._local, "counters", None)
+        if counters is None:
+            counters = {
+                "processed": 0,
+                "success": 0,
+                "failed": 0,
+                "skipped": 0,
+                "retries": 0,
+                "recovered": 0,
+                "failed_by_category": {},
+                "success_files": [],
+                "failed_files": []
+            }
+            self._local.counters = counters
+            self._workers.append(counters)
+        return counters
+    
+    def record_success(self, filename: str, message: str, retried: bool = False):
+        """Record a converted file; retried marks one that needed a retry"""
+        counters = self._counters()
+        counters["processed"] += 1
+        counters["success"] += 1
+        if retried:
+            counters["recovered"] += 1
+        if len(counters["success_files"]) < self.max_samples:
+            counters["success_files"].append((filename, message))
+        if self.report:
+            self.report.record("success", filename, message)
+        if self.metrics:
+            self.metrics.inc("peppol_files_total", "success")
+    
+    def record_failure(self, filename: str, message: str, category: str):
+        """Record a file that could not be converted"""
+        counters = self._counters()
+        counters["processed"] += 1
+        counters["failed"] += 1
+        by_category = counters["failed_by_category"]
+        by_category[category] = by_category.get(category, 0) + 1
+        if len(counters["failed_files"]) < self.max_samples:
+            counters["failed_files"].append((filename, message))
+        if self.report:
+            self.report.record("failed", filename, message, category)
+        if self.metrics:
+            self.metrics.inc("peppol_files_total", "failed")
+            self.metrics.inc("peppol_failures_total", category)
+    
+    def record_retry(self, filename: str):
+        """Record a transient failure that was queued for another attempt"""
+        self._counters()["retries"] += 1
+        if self.metrics:
+            self.metrics.inc("peppol_retries_total")
+    
+    def record_skipped(self, filename: str):
+        """Record a file another converter instance claimed first"""
+        self._counters()["skipped"] += 1
+        if self.metrics:
+            self.metrics.inc("peppol_files_total", "skipped")
+    
+    def merge(self) -> Dict:
+        """Combine all worker counters into one statistics dict"""
+        merged = {
+            "processed": 0,
+            "success": 0,
+            "failed": 0,
+            "skipped": 0,
+            "retries": 0,
+            "recovered": 0,
+            "failed_by_category": {},
+            "success_files": [],
+            "failed_files": []
+        }
+        for counters in list(self._workers):
+            for key in ("processed", "success", "failed", "skipped", "retries", "recovered"):
+                merged[key] += counters[key]
+            for category, count in counters["failed_by_category"].items():
+                merged["failed_by_category"][category] = merged["failed_by_category"].get(category, 0) + count
+            merged["success_files"].extend(counters["success_files"])
+            merged["failed_files"].extend(counters["failed_files"])
+        del merged["success_files"][self.max_samples:]
+        del merged["failed_files"][self.max_samples:]
+        return merged
+
+
+class StageTimings:
+    """Accumulates time spent in each processing stage
+    
+    Like BatchStats, every thread adds to its own totals and readers merge them.
+    """
+    
+    def __init__(self, metrics: Optional["ConverterMetrics"] = None):
+        self._local = threading.local()
+        self._workers = []  # (totals, counts) of every thread that recorded a sample
+        self.metrics = metrics  # Also feeds the stage latency histograms when set
+    
+    def add(self, stage: str, seconds: float):
+        """Record one sample for a stage"""
+        if self.metrics:
+            self.metrics.observe("peppol_stage_seconds", stage, seconds)
+        own = getattr(self._local, "own", None)
+        if own is None:
+            own = self._local.own = ({}, {})
+            self._workers.append(own)
+        totals, counts = own
+        totals[stage] = totals.get(stage, 0.0) + seconds
+        counts[stage] = counts.get(stage, 0) + 1
+        capture = getattr(self._local, "capture", None)
+        if capture is not None:
+            capture[stage] = capture.get(stage, 0.0) + seconds
+    
+    def begin_capture(self):
+        """Start collecting this thread's samples separately, e.g. for one file"""
+        self._local.capture = {}
+    
+    def end_capture(self) -> Dict[str, float]:
+        """Stop collecting and return the seconds per stage since begin_capture"""
+        capture = getattr(self._local, "capture", None)
+        self._local.capture = None
+        return capture or {}
+    
+    def _merged(self) -> Tuple[Dict[str, float], Dict[str, int]]:
+        merged_totals, merged_counts = {}, {}
+        for totals, counts in list(self._workers):
+            for stage, seconds in dict(totals).items():
+                merged_totals[stage] = merged_totals.get(stage, 0.0) + seconds
+            for stage, count in dict(counts).items():
+                merged_counts[stage] = merged_counts.get(stage, 0) + count
+        return merged_totals, merged_counts
+    
+    def totals(self) -> Dict[str, float]:
+        """Return total seconds per stage across all threads"""
+        return self._merged()[0]
+    
+    def summary(self) -> Dict[str, Dict]:
+        """Return per-stage count, total seconds and mean microseconds"""
+        totals, counts = self._merged()
+        return {
+            stage: {
+                "count": counts[stage],
+                "total_seconds": total,
+                "mean_us": total / counts[stage] * 1e6
+            }
+            for stage, total in totals.items()
+        }
+
+
+DURABILITY_MODES = ("none", "batch", "strict")
+
+
+def fsync_file(path: str):
+    """Flush a file's contents to stable storage"""
+    # Windows only allows fsync on descriptors opened for writing
+    fd = os.open(path, os.O_RDWR if sys.platform == 'win32' else os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(directory: str):
+    """Flush a directory's entries (created and renamed files) to stable storage"""
+    if sys.platform == 'win32':
+        return  # Directories can't be opened for fsync on Windows; NTFS journals metadata
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+OUTPUT_MODES = ("files", "zip")
+
+
+class ArchiveWriter:
+    """Appends converted invoices to rolling, size- and count-bounded ZIP archives
+    
+    Every member is also recorded in archive_index.jsonl with its local header
+    offset, so a single invoice can be read back with one seek even from an
+    archive whose central directory was never written.
+    
+    An archive is only ever appended to by one writer: writers in this process
+    are tracked in _in_use and other processes are kept out with an exclusive
+    lock on the archive file.
+    """
+    INDEX_NAME = "archive_index.jsonl"
+    LOOKUP_NAME = "archive_index.sqlite"  # Name-keyed copy of the index, kept up to date by readers
+    ARCHIVE_PATTERN = re.compile(r'^invoices_\d{8}_\d{6}_\d{3}\.zip$')
+    _in_use = set()  # Archive paths open for writing in this process
+    _in_use_lock = threading.Lock()
+    
+    def __init__(self, directory: str, max_members: int = 10000, max_mb: float = 512, durability: str = "none"):
+        self.directory = directory
+        self.max_members = max_members
+        self.max_bytes = max_mb * 1024 * 1024
+        self.durability = durability
+        self.lock = threading.Lock()
+        self.archive = None
+        self.archive_file = None  # Locked file object under self.archive
+        self.archive_path = None
+        self.members = 0
+        self.sequence = 0
+        self.index_file = open(os.path.join(directory, self.INDEX_NAME), 'a', encoding='utf-8')
+        self._resume_latest()
+    
+    @classmethod
+    def _take(cls, path: str, archive_file) -> bool:
+        """Claim an archive file for this writer; False if another writer has it"""
+        with cls._in_use_lock:
+            if path in cls._in_use:
+                return False
+            if 'fcntl' in globals():
+                try:
+                    fcntl.lockf(archive_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return False
+            cls._in_use.add(path)
+            return True
+    
+    @classmethod
+    def _give_back(cls, path: str):
+        """Forget an archive claimed with _take; closing its file releases the lock"""
+        with cls._in_use_lock:
+            cls._in_use.discard(path)
+    
+    def _resume_latest(self):
+        """Keep appending to the newest archive if it is still under its limits and nobody else writes it"""
+        if 'fcntl' not in globals():
+            return  # Without file locks another instance might be appending to it
+        with os.scandir(self.directory) as entries:
+            names = sorted(entry.name for entry in entries if self.ARCHIVE_PATTERN.match(entry.name))
+        if not names:
+            return
+        path = os.path.join(self.directory, names[-1])
+        try:
+            if os.path.getsize(path) >= self.max_bytes:
+                return
+            archive_file = open(path, 'r+b')
+        except OSError as e:
+            logging.warning(f"Not resuming archive {path}: {str(e)}")
+            return
+        if not self._take(path, archive_file):
+            archive_file.close()
+            return
+        try:
+            archive = zipfile.ZipFile(archive_file, 'a')
+        except (OSError, zipfile.BadZipFile) as e:
+            logging.warning(f"Not resuming archive {path}: {str(e)}")
+            archive_file.close()
+            self._give_back(path)
+            return
+        if len(archive.infolist()) >= self.max_members:
+            archive.close()
+            archive_file.close()
+            self._give_back(path)
+            return
+        self.archive, self.archive_file, self.archive_path = archive, archive_file, path
+        self.members = len(archive.infolist())
+    
+    def _roll_over(self):
+        """Close the current archive and start a new one"""
+        if self.archive:
+            self._close_archive()
+        while True:
+            self.sequence += 1
+            name = f"invoices_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.sequence % 1000:03d}.zip"
+            path = os.path.join(self.directory, name)
+            try:
+                archive_file = open(path, 'xb')
+            except FileExistsError:
+                continue  # Another batch or instance rolled over within the same second
+            if self._take(path, archive_file):
+                break
+            archive_file.close()  # Another writer reopened it between our create and lock
+        self.archive = zipfile.ZipFile(archive_file, 'w')
+        self.archive_file, self.archive_path = archive_file, path
+        self.members = 0
+    
+    def add(self, member: str, data: bytes, compress: bool = False) -> str:
+        """Append one member and index it
+        
+        Args:
+            member: Name inside the archive
+            data: Member contents
+            compress: Deflate the member (PDFs are already compressed, XMLs are not)
+            
+        Returns:
+            Location of the member as "<archive path>!/<member>"
+        """
+        with self.lock:
+            if (self.archive is None or self.members >= self.max_members
+                    or self.archive.fp.tell() + len(data) > self.max_bytes):
+                self._roll_over()
+            
+            self.archive.writestr(member, data, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+            info = self.archive.infolist()[-1]
+            self.members += 1
+            self.index_file.write(json.dumps({
+                "name": member,
+                "archive": os.path.basename(self.archive_path),
+                "offset": info.header_offset,
+                "compress_size": info.compress_size,
+                "file_size": info.file_size,
+                "method": info.compress_type,
+                "crc": info.CRC
+            }) + "\n")
+            
+            # Callers delete the source once this returns, so nothing may stay in our buffers
+            self.archive_file.flush()
+            self.index_file.flush()
+            if self.durability == "strict":
+                os.fsync(self.archive_file.fileno())
+                os.fsync(self.index_file.fileno())
+            return f"{self.archive_path}!/{member}"
+    
+    def _close_archive(self):
+        """Write the central directory of the current archive and release it"""
+        try:
+            self.archive.close()
+            if self.durability != "none":
+                self.archive_file.flush()
+                os.fsync(self.archive_file.fileno())
+        finally:
+            self.archive_file.close()
+            self._give_back(self.archive_path)
+            self.archive = None
+            self.archive_file = None
+    
+    def close(self):
+        """Finish the current archive and the index"""
+        with self.lock:
+            if self.archive:
+                self._close_archive()
+            self.index_file.close()
+            if self.durability != "none":
+                fsync_file(self.index_file.name)
+                fsync_directory(self.directory)
+
+
+def find_archive_entry(directory: str, member: str) -> Optional[Dict]:
+    """Look up a member's index entry in the name-keyed SQLite copy of archive_index.jsonl
+    
+    The copy first takes in the index lines written since the previous lookup,
+    so writers never pay for it and a lookup costs the new lines plus one
+    primary key probe. Later entries win for repeated names.
+    """
+    index_path = os.path.join(directory, ArchiveWriter.INDEX_NAME)
+    conn = sqlite3.connect(os.path.join(directory, ArchiveWriter.LOOKUP_NAME), timeout=30, isolation_level=None)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS members (name TEXT PRIMARY KEY, entry TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS progress (id INTEGER PRIMARY KEY CHECK (id = 0), index_offset INTEGER)")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT index_offset FROM progress WHERE id = 0").fetchone()
+            offset = row[0] if row else 0
+            size = os.path.getsize(index_path)
+            if size < offset:
+                # The index was replaced: build the copy again
+                conn.execute("DELETE FROM members")
+                offset = 0
+            if size > offset:
+                rows = []
+                with open(index_path, 'rb') as index:
+                    index.seek(offset)
+                    for line in index:
+                        if not line.endswith(b"\n"):
+                            break  # Still being written
+                        offset += len(line)
+                        try:
+                            rows.append((json.loads(line)["name"], line.decode('utf-8').rstrip("\n")))
+                        except (ValueError, KeyError):
+                            continue  # Torn line from a crash
+                conn.executemany("INSERT OR REPLACE INTO members (name, entry) VALUES (?, ?)", rows)
+                conn.execute("INSERT OR REPLACE INTO progress (id, index_offset) VALUES (0, ?)", (offset,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        row = conn.execute("SELECT entry FROM members WHERE name = ?", (member,)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def extract_archived_invoice(directory: str, member: str) -> bytes:
+    """Read one member back from the rolling archives using the offset index
+    
+    Args:
+        directory: Output directory holding the archives and archive_index.jsonl
+        member: Member name, e.g. "invoice123.pdf"
+        
+    Returns:
+        The member's contents
+    """
+    entry = find_archive_entry(directory, member)
+    if entry is None:
+        raise KeyError(f"{member} not found in archive index")
+    
+    with open(os.path.join(directory, entry["archive"]), 'rb') as archive:
+        archive.seek(entry["offset"])
+        # Local file header: signature, 5 shorts, 3 longs, name and extra field lengths
+        fields = struct.unpack("<4s5H3L2H", archive.read(30))
+        if fields[0] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"Bad local header for {member} in {entry['archive']}")
+        archive.seek(fields[9] + fields[10], os.SEEK_CUR)
+        data = archive.read(entry["compress_size"])
+    
+    if entry["method"] == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    if zlib.crc32(data) != entry["crc"]:
+        raise zipfile.BadZipFile(f"CRC mismatch for {member} in {entry['archive']}")
+    return data
+
+
+def qualify_path(path: str) -> str:
+    """Expand prefix:Tag steps of a path into fully qualified {uri}Tag steps"""
+    return re.sub(r'(\w+):(\w+)', lambda m: f"{{{NAMESPACES[m.group(1)]}}}{m.group(2)}", path)
+
+
+class FormatProfile:
+    """A PEPPOL document format with precompiled, fully qualified lookup paths"""
+    
+    def __init__(self, name: str, root_tag: str, attachment_path: str):
+        self.name = name
+        self.root_tag = qualify_path(root_tag)
+        self.attachment_path = qualify_path(attachment_path)
+        # Walking single-tag steps keeps each find() on ElementTree's C fast path
+        self.attachment_steps = tuple(self.attachment_path.split('/'))
+        self.attachment_tag = self.attachment_steps[-1]
+    
+    def find_attachment(self, root):
+        """Return the first embedded document element, trying the known path first"""
+        element = root
+        for tag in self.attachment_steps:
+            element = element.find(tag)
+            if element is None:
+                break
+        if element is None:
+            # Attachment outside its usual place: C-level tag filter, still no string matching
+            element = next(root.iter(self.attachment_tag), None)
+        return element
+
+
+FORMAT_PROFILES = {}  # Fully qualified root tag -> FormatProfile
+
+
+def register_format_profile(profile: FormatProfile):
+    """Make a document format known to the converter"""
+    FORMAT_PROFILES[profile.root_tag] = profile
+
+
+def detect_format_profile(root) -> Optional[FormatProfile]:
+    """Look up the profile for a parsed document from its root element"""
+    return FORMAT_PROFILES.get(root.tag)
+
+
+_UBL_ATTACHMENT = "cac:AdditionalDocumentReference/cac:Attachment/cbc:EmbeddedDocumentBinaryObject"
+register_format_profile(FormatProfile("UBL Invoice", "inv:Invoice", _UBL_ATTACHMENT))
+register_format_profile(FormatProfile("UBL CreditNote", "cn:CreditNote", _UBL_ATTACHMENT))
+register_format_profile(FormatProfile("UBL Order", "ord:Order", _UBL_ATTACHMENT))
+register_format_profile(FormatProfile(
+    "UN/CEFACT CII Invoice", "rsm:CrossIndustryInvoice",
+    "rsm:SupplyChainTradeTransaction/ram:ApplicableHeaderTradeAgreement/"
+    "ram:AdditionalReferencedDocument/ram:AttachmentBinaryObject"
+))
+
+
+DEFAULT_METADATA_FIELDS = {
+    "invoice_id": "cbc:ID",
+    "issue_date": "cbc:IssueDate",
+    "currency": "cbc:DocumentCurrencyCode",
+    "supplier_id": "cac:AccountingSupplierParty/cac:Party/cbc:EndpointID",
+    "supplier_name": "cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name",
+    "customer_id": "cac:AccountingCustomerParty/cac:Party/cbc:EndpointID",
+    "customer_name": "cac:AccountingCustomerParty/cac:Party/cac:PartyName/cbc:Name",
+    "payable_amount": "cac:LegalMonetaryTotal/cbc:PayableAmount"
+}
+
+
+def extract_metadata(root, fields: Dict[str, str]) -> Dict[str, str]:
+    """Read the configured cbc/cac fields from a parsed invoice root
+    
+    Args:
+        root: Root element of the parsed UBL document
+        fields: Mapping of field name to a path relative to the root, e.g. "cbc:ID"
+        
+    Returns:
+        Mapping of field name to stripped text for the fields that are present
+    """
+    metadata = {}
+    for name, path in fields.items():
+        value = root.findtext(path, namespaces=NAMESPACES)
+        if value and value.strip():
+            metadata[name] = value.strip()
+    return metadata
+
+
+OUTPUT_LAYOUTS = ("flat", "date", "issue_date", "supplier", "hash")
+
+
+class OutputLayout:
+    """Spreads converted invoices over subdirectories of the output directory
+    
+    Layouts:
+        date: YYYY/MM/DD of the conversion
+        issue_date: YYYY/MM/DD from cbc:IssueDate, or the conversion date when
+            the invoice has none or it is malformed
+        supplier: The supplier's endpoint ID, made safe as a directory name
+        hash: Two hex digits of the file name's SHA-1, filling 256 directories evenly
+    
+    Directories are created on first use and remembered, so makedirs runs
+    once per directory for the life of the converter, not once per file. A
+    remembered directory that was removed since is re-created by recreate().
+    """
+    
+    FIELD = "__layout__"  # Metadata key the layout's field is extracted under
+    FIELD_PATHS = {
+        "issue_date": "cbc:IssueDate",
+        "supplier": DEFAULT_METADATA_FIELDS["supplier_id"]
+    }
+    DATE_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+    UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9._-]+')
+    UNKNOWN_SUPPLIER = "_unknown"
+    
+    def __init__(self, root: str, layout: str):
+        self.root = root
+        self.layout = layout
+        self._created = set()
+        self._lock = threading.Lock()
+    
+    def fields(self) -> Dict[str, str]:
+        """Field the layout needs from the parsed invoice, keyed by FIELD"""
+        path = self.FIELD_PATHS.get(self.layout)
+        return {self.FIELD: path} if path else {}
+    
+    def relative_path(self, filename: str, value: Optional[str] = None) -> str:
+        """Subdirectory for a file, given the value of the layout's field"""
+        if self.layout == "hash":
+            return hashlib.sha1(filename.encode('utf-8')).hexdigest()[:2]
+        if self.layout == "supplier":
+            name = self.UNSAFE_CHARS.sub("_", value or "").strip("._")[:64]
+            return name or self.UNKNOWN_SUPPLIER
+        if self.layout == "issue_date" and value:
+            match = self.DATE_PATTERN.match(value.strip())
+            if match:
+                return os.path.join(*match.groups())
+        today = datetime.date.today()
+        return os.path.join(f"{today:%Y}", f"{today:%m}", f"{today:%d}")
+    
+    def directory(self, filename: str, value: Optional[str] = None) -> Tuple[str, bool]:
+        """Return the directory for a file and whether it had to be created"""
+        path = os.path.join(self.root, self.relative_path(filename, value))
+        if path in self._created:
+            return path, False
+        with self._lock:
+            created = not os.path.isdir(path)
+            os.makedirs(path, exist_ok=True)
+            self._created.add(path)
+        return path, created
+    
+    def recreate(self, path: str):
+        """Create a remembered directory again after it was removed behind our back"""
+        with self._lock:
+            self._created.discard(path)
+            os.makedirs(path, exist_ok=True)
+            self._created.add(path)
+    
+    def parents(self, path: str) -> List[str]:
+        """Directories from a subdirectory's parent up to the output directory"""
+        parents = []
+        path = os.path.dirname(path)
+        while len(path) >= len(self.root):
+            parents.append(path)
+            path = os.path.dirname(path)
+        return parents
+
+
+class MetadataIndex:
+    """Local SQLite index of invoice header fields keyed by output path"""
+    FLUSH_EVERY = 500  # Pending rows written per transaction
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = []
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS invoices ("
+                "output_path TEXT PRIMARY KEY, source_file TEXT, indexed_at TEXT)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS invoice_fields ("
+                "output_path TEXT, field TEXT, value TEXT, PRIMARY KEY (output_path, field))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoice_fields_value ON invoice_fields (field, value)"
+            )
+    
+    def add(self, output_path: str, source_file: str, metadata: Dict[str, str]):
+        """Queue an invoice for the index; rows are written in batches"""
+        with self.lock:
+            self.pending.append((output_path, source_file, metadata))
+            if len(self.pending) >= self.FLUSH_EVERY:
+                self._flush_locked()
+    
+    def flush(self):
+        """Write all queued invoices in one transaction"""
+        with self.lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        if not self.pending:
+            return
+        indexed_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO invoices (output_path, source_file, indexed_at) VALUES (?, ?, ?)",
+                [(output_path, source_file, indexed_at) for output_path, source_file, _ in self.pending]
+            )
+            self.conn.executemany(
+                "DELETE FROM invoice_fields WHERE output_path = ?",
+                [(output_path,) for output_path, _, _ in self.pending]
+            )
+            self.conn.executemany(
+                "INSERT INTO invoice_fields (output_path, field, value) VALUES (?, ?, ?)",
+                [(output_path, field, value)
+                 for output_path, _, metadata in self.pending
+                 for field, value in metadata.items()]
+            )
+        self.pending = []
+    
+    def find(self, field: str, value: str) -> List[Dict[str, str]]:
+        """Find invoices whose field equals value; % acts as a LIKE wildcard
+        
+        Returns:
+            List of dicts with output_path, source_file and all indexed fields
+        """
+        self.flush()
+        operator = "LIKE" if '%' in value else "="
+        with self.lock:
+            paths = [row[0] for row in self.conn.execute(
+                f"SELECT output_path FROM invoice_fields WHERE field = ? AND value {operator} ?",
+                (field, value)
+            )]
+            results = []
+            for output_path in paths:
+                row = self.conn.execute(
+                    "SELECT source_file FROM invoices WHERE output_path = ?", (output_path,)
+                ).fetchone()
+                result = {"output_path": output_path, "source_file": row[0] if row else None}
+                result.update(self.conn.execute(
+                    "SELECT field, value FROM invoice_fields WHERE output_path = ?", (output_path,)
+                ).fetchall())
+                results.append(result)
+        return results
+    
+    def close(self):
+        """Write pending rows and close the database"""
+        self.flush()
+        self.conn.close()
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's content, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FailureIndex:
+    """Sidecar index of the files in the failed directory
+    
+    Records error class, time, attempt count and a content hash per file as JSON
+    lines next to the failed files. A later line for a file replaces earlier
+    ones and a "resolved" line removes it; compact() rewrites the file with only
+    the current entries.
+    """
+    INDEX_NAME = ".failure_index.jsonl"
+    ERROR_MAX_CHARS = 500
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, self.INDEX_NAME)
+        self._lock = threading.Lock()
+        self._entries = None  # file name -> entry, loaded on first use
+    
+    def _load_locked(self) -> Dict[str, Dict]:
+        if self._entries is None:
+            entries = {}
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # Torn line from an interrupted write
+                        if entry.get("resolved"):
+                            entries.pop(entry["file"], None)
+                        else:
+                            entries[entry["file"]] = entry
+            except FileNotFoundError:
+                pass
+            self._entries = entries
+        return self._entries
+    
+    def _append_locked(self, entry: Dict):
+        # One write per line keeps lines from concurrent instances apart
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    
+    def entries(self) -> Dict[str, Dict]:
+        """Return the current entry of every indexed file"""
+        with self._lock:
+            return dict(self._load_locked())
+    
+    def record(self, filename: str, category: str, error: str) -> Dict:
+        """Index a file that was just moved into the directory"""
+        path = os.path.join(self.directory, filename)
+        st = os.stat(path)
+        entry = {
+            "file": filename,
+            "category": category,
+            "error": error[:self.ERROR_MAX_CHARS],
+            "failed_at": datetime.datetime.now().isoformat(timespec='seconds'),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": file_digest(path)
+        }
+        with self._lock:
+            previous = self._load_locked().get(filename)
+            entry["attempts"] = previous["attempts"] + 1 if previous else 1
+            self._entries[filename] = entry
+            self._append_locked(entry)
+        return entry
+    
+    def resolve(self, filename: str):
+        """Drop a file from the index, e.g. after it was reprocessed successfully"""
+        with self._lock:
+            if self._load_locked().pop(filename, None) is not None:
+                self._append_locked({"file": filename, "resolved": True})
+    
+    def is_changed(self, entry: Dict) -> bool:
+        """Tell whether a failed file's content differs from when it failed
+        
+        Size and modification time are compared first so unchanged files are
+        not read at all.
+        """
+        path = os.path.join(self.directory, entry["file"])
+        st = os.stat(path)
+        if st.st_size == entry.get("size") and st.st_mtime_ns == entry.get("mtime_ns"):
+            return False
+        return file_digest(path) != entry.get("sha256")
+    
+    def select(self, categories: Optional[List[str]] = None, changed: bool = False) -> List[str]:
+        """Pick failed files to reprocess
+        
+        Args:
+            categories: Error classes to include; files missing from the index count as "unknown"
+            changed: Include files whose content changed since they failed
+            
+        Returns:
+            Paths of the selected files; every XML file when no filter is given
+        """
+        entries = self.entries()
+        selected = []
+        for path in list_input_files(self.directory):
+            entry = entries.get(os.path.basename(path))
+            if not categories and not changed:
+                selected.append(path)
+            elif categories and (entry["category"] if entry else "unknown") in categories:
+                selected.append(path)
+            elif changed and entry is not None and self.is_changed(entry):
+                selected.append(path)
+        return selected
+    
+    def compact(self):
+        """Rewrite the index with only the current entries of files still present"""
+        with self._lock:
+            entries = self._load_locked()
+            for filename in [name for name in entries if not os.path.exists(os.path.join(self.directory, name))]:
+                del entries[filename]
+            temp_file = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                for entry in entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(temp_file, self.path)
+
+
+COLLISION_STRATEGIES = ("overwrite", "suffix", "hash", "skip_identical")
+
+
+class OutputNames:
+    """Chooses collision-free file names in output and failed directories
+    
+    Each directory is listed with one scandir the first time a batch writes
+    to it; afterwards names are checked against that in-memory set and every
+    name handed out is added to it, so no per-file stat calls are needed.
+    Batches running at the same time share one instance, so they see each
+    other's names. Files created by other instances after the listing are not
+    seen; writers create files exclusively and claim again when one exists.
+    
+    Strategies:
+        overwrite: Keep the name, replacing any existing file
+        suffix: Append _1, _2, ... to the stem until the name is free
+        hash: Name the file after its content, so a resend of the same content
+            maps to the existing file and different content never collides
+        skip_identical: Keep the name if free, report an existing file with the
+            same content as identical, otherwise fall back to a suffix
+    """
+    
+    HASH_CHARS = 12  # Hex digits of the SHA-256 appended by the hash strategy
+    
+    def __init__(self, strategy: str = "suffix"):
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._names = {}  # directory -> set of normcased file names
+    
+    def _listing(self, directory: str) -> set:
+        """Return the name set of a directory, listing it on first use"""
+        names = self._names.get(directory)
+        if names is None:
+            names = set()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        names.add(os.path.normcase(entry.name))
+            except FileNotFoundError:
+                pass
+            self._names[directory] = names
+        return names
+    
+    @staticmethod
+    def _same_content(path: str, content) -> bool:
+        """Compare an existing file with bytes or with another file"""
+        try:
+            if isinstance(content, bytes):
+                if os.path.getsize(path) != len(content):
+                    return False
+                with open(path, 'rb') as f:
+                    return f.read() == content
+            if os.path.getsize(path) != os.path.getsize(content):
+                return False
+            return file_digest(path) == file_digest(content)
+        except OSError:
+            return False
+    
+    def claim(self, directory: str, filename: str, content=None, derived: bool = False) -> Tuple[str, bool]:
+        """Pick the name to write a file under and reserve it for the batch
+        
+        Args:
+            directory: Target directory
+            filename: Name the file would get without collision handling
+            content: File content as bytes, or the path of the file being moved;
+                needed by the hash and skip_identical strategies
+            derived: The name was already resolved for a companion file (the XML
+                moved next to its PDF), so it is not hashed again
+            
+        Returns:
+            Tuple[str, bool]: (file name, whether an identical file already has that name)
+        """
+        strategy = self.strategy
+        if strategy == "overwrite":
+            return filename, False
+        if derived and strategy == "hash":
+            strategy = "skip_identical"
+        
+        stem, ext = os.path.splitext(filename)
+        if strategy == "hash":
+            if isinstance(content, bytes):
+                digest = hashlib.sha256(content).hexdigest()
+            else:
+                digest = file_digest(content)
+            filename = f"{stem}_{digest[:self.HASH_CHARS]}{ext}"
+        
+        with self._lock:
+            names = self._listing(directory)
+            key = os.path.normcase(filename)
+            if key not in names:
+                names.add(key)
+                return filename, False
+            if strategy == "hash":
+                # Same name means same content
+                return filename, True
+            if strategy == "skip_identical" and content is not None and \
+                    self._same_content(os.path.join(directory, filename), content):
+                return filename, True
+            counter = 1
+            while os.path.normcase(f"{stem}_{counter}{ext}") in names:
+                counter += 1
+            filename = f"{stem}_{counter}{ext}"
+            names.add(os.path.normcase(filename))
+            return filename, False
+
+
+_pikepdf = None  # Loaded on first use; False once the import has failed
+
+
+def pdf_optimizer_available() -> bool:
+    """Import pikepdf on first call and tell whether PDFs can be optimised"""
+    global _pikepdf
+    if _pikepdf is None:
+        try:
+            import pikepdf
+            _pikepdf = pikepdf
+        except ImportError:
+            _pikepdf = False
+    return bool(_pikepdf)
+
+
+def _stream_key(stream) -> Tuple:
+    """Identity of a stream's content: raw (still encoded) bytes plus its dictionary"""
+    items = tuple(sorted((str(key), repr(value)) for key, value in stream.items() if key != "/Length"))
+    return stream.read_raw_bytes(), items
+
+
+def optimize_pdf(data: bytes) -> bytes:
+    """Rewrite a PDF with object streams, identical streams merged, and linearised
+    
+    Suppliers often embed the same font or logo once per page or form; every
+    duplicate is pointed at the first copy and qpdf drops the unreferenced rest
+    when saving. Call pdf_optimizer_available() first.
+    
+    Args:
+        data: PDF bytes as decoded from the invoice
+        
+    Returns:
+        The rewritten PDF bytes
+    """
+    pikepdf = _pikepdf
+    with pikepdf.open(io.BytesIO(data)) as pdf:
+        canonical = {}  # Stream key -> first stream with that content
+        duplicates = {}  # objgen of a duplicate -> first stream
+        for obj in pdf.objects:
+            if isinstance(obj, pikepdf.Stream):
+                first = canonical.setdefault(_stream_key(obj), obj)
+                if first.objgen != obj.objgen:
+                    duplicates[obj.objgen] = first
+        
+        if duplicates:
+            # Repoint references held in dictionaries and arrays, including
+            # ones nested directly inside other objects
+            def repoint(container):
+                keys = range(len(container)) if isinstance(container, pikepdf.Array) else list(container.keys())
+                for key in keys:
+                    value = container[key]
+                    if not isinstance(value, pikepdf.Object):
+                        continue  # Numbers and booleans come back as Python values
+                    if value.is_indirect:
+                        if value.objgen in duplicates:
+                            container[key] = duplicates[value.objgen]
+                    elif isinstance(value, (pikepdf.Dictionary, pikepdf.Array)):
+                        repoint(value)
+            
+            for obj in pdf.objects:
+                if isinstance(obj, (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream)):
+                    repoint(obj)
+            repoint(pdf.trailer)
+        
+        output = io.BytesIO()
+        pdf.save(output, linearize=True, compress_streams=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    return output.getvalue()
+
+
+class XmlParserBackend(abc.ABC):
+    """Parses an invoice into an ElementTree-compatible root element
+    
+    Every backend enforces the same limits: documents nested deeper than
+    max_depth are rejected, and with forbid_entities so is any document that
+    declares entities (PEPPOL documents never need a DTD). Malformed XML
+    raises ET.ParseError whatever the backend. Backends only hold plain
+    settings, so they can be passed to worker processes.
+    """
+    
+    name = ""
+    PROLOG_BYTES = 64 * 1024  # Where a DOCTYPE has to end for the entity check
+    BLOCK_SIZE = 1024 * 1024  # Read size when feeding a parser
+    
+    def __init__(self, max_depth: int = 256, forbid_entities: bool = True):
+        self.max_depth = max_depth
+        self.forbid_entities = forbid_entities
+    
+    @classmethod
+    def available(cls) -> bool:
+        return True
+    
+    @abc.abstractmethod
+    def parse(self, xml_file: str):
+        """Parse a file and return its root element"""
+    
+    def check_prolog(self, head: bytes):
+        """Reject documents with a DOCTYPE that declares entities or runs past PROLOG_BYTES
+        
+        Args:
+            head: The first PROLOG_BYTES of the document
+        """
+        if head.startswith((b'\xff\xfe', b'\xfe\xff')):
+            head = head.decode('utf-16', errors='ignore').encode('utf-8')
+        doctype = head.find(b'<!DOCTYPE')
+        if doctype < 0:
+            return
+        end = head.find(b']>', doctype)
+        if b'<!ENTITY' in head[doctype:] or (end < 0 and b'[' in head[doctype:]):
+            raise ConversionError("XML dokuments deklarē entītijas, kas nav atļautas", "xml_limits")
+    
+    def check_depth(self, root):
+        """Reject trees nested deeper than max_depth with one C-level path search"""
+        if self.max_depth and root.find("/".join(["*"] * self.max_depth)) is not None:
+            raise ConversionError(f"XML dokuments pārsniedz maksimālo dziļumu {self.max_depth}", "xml_limits")
+
+
+class EtreeParser(XmlParserBackend):
+    """The standard library's C accelerated ElementTree parser"""
+    
+    name = "etree"
+    
+    def parse(self, xml_file: str):
+        # One pass over the file: the prolog block is checked and then fed like the rest
+        parser = ET.XMLParser()
+        with open(xml_file, 'rb') as f:
+            head = f.read(self.PROLOG_BYTES)
+            if self.forbid_entities:
+                self.check_prolog(head)
+            parser.feed(head)
+            for block in iter(lambda: f.read(self.BLOCK_SIZE), b''):
+                parser.feed(block)
+        root = parser.close()
+        self.check_depth(root)
+        return root
+
+
+class ExpatParser(XmlParserBackend):
+    """Builds the tree from pyexpat callbacks fed in large blocks
+    
+    Character data is collected as a list of chunks per element and joined
+    once, so a base64 payload arriving as thousands of short lines costs a
+    single join. Limits are checked while parsing: a too deep or entity
+    declaring document stops at the offending element, not after the whole
+    file has been read.
+    """
+    
+    name = "expat"
+    
+    def parse(self, xml_file: str):
+        from xml.parsers import expat
+        parser = expat.ParserCreate(namespace_separator="}")
+        parser.buffer_text = True
+        parser.buffer_size = self.BLOCK_SIZE
+        parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        
+        stack = []
+        chunks = []
+        target = [None, "text"]  # Element and attribute the pending chunks belong to
+        root = []
+        max_depth = self.max_depth
+        
+        def flush():
+            if chunks:
+                if target[0] is not None:
+                    setattr(target[0], target[1], "".join(chunks))
+                chunks.clear()
+        
+        def start(name, attrs):
+            flush()
+            if max_depth and len(stack) >= max_depth:
+                raise ConversionError(f"XML dokuments pārsniedz maksimālo dziļumu {max_depth}", "xml_limits")
+            tag = "{" + name if "}" in name else name
+            if attrs:
+                attrs = {("{" + key if "}" in key else key): value for key, value in attrs.items()}
+            if stack:
+                element = ET.SubElement(stack[-1], tag, attrs)
+            else:
+                element = ET.Element(tag, attrs)
+                root.append(element)
+            stack.append(element)
+            target[0], target[1] = element, "text"
+        
+        def end(name):
+            flush()
+            element = stack.pop()
+            # Whitespace after the root element is not kept, as in ElementTree
+            target[0], target[1] = (element, "tail") if stack else (None, "tail")
+        
+        def entity_declared(*args):
+            raise ConversionError("XML dokuments deklarē entītijas, kas nav atļautas", "xml_limits")
+        
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = chunks.append
+        if self.forbid_entities:
+            parser.EntityDeclHandler = entity_declared
+        
+        try:
+            with open(xml_file, 'rb') as f:
+                for block in iter(lambda: f.read(self.BLOCK_SIZE), b''):
+                    parser.Parse(block, False)
+            parser.Parse(b'', True)
+        except expat.ExpatError as e:
+            raise ET.ParseError(str(e)) from None
+        return root[0]
+
+
+_lxml_etree = None  # Loaded on first use; False once the import has failed
+
+
+def lxml_available() -> bool:
+    """Import lxml on first call and tell whether its parser can be used"""
+    global _lxml_etree
+    if _lxml_etree is None:
+        try:
+            from lxml import etree as lxml_etree
+            _lxml_etree = lxml_etree
+        except ImportError:
+            _lxml_etree = False
+    return bool(_lxml_etree)
+
+
+class LxmlParser(XmlParserBackend):
+    """libxml2 through lxml, when installed; never resolves entities or touches the network"""
+    
+    name = "lxml"
+    
+    @classmethod
+    def available(cls) -> bool:
+        return lxml_available()
+    
+    def parse(self, xml_file: str):
+        lxml_available()
+        lxml_etree = _lxml_etree
+        # huge_tree lifts libxml2's 10 MB text node limit; depth is checked below instead
+        parser = lxml_etree.XMLParser(resolve_entities=False, no_network=True, load_dtd=False, huge_tree=True)
+        try:
+            tree = lxml_etree.parse(xml_file, parser)
+        except lxml_etree.XMLSyntaxError as e:
+            raise ET.ParseError(str(e)) from None
+        if self.forbid_entities:
+            dtd = tree.docinfo.internalDTD
+            if dtd is not None and any(True for _ in dtd.iterentities()):
+                raise ConversionError("XML dokuments deklarē entītijas, kas nav atļautas", "xml_limits")
+        root = tree.getroot()
+        self.check_depth(root)
+        return root
+
+
+PARSER_BACKENDS = {backend.name: backend for backend in (EtreeParser, ExpatParser, LxmlParser)}
+
+
+def create_parser_backend(name: str = "auto", max_depth: int = 256, forbid_entities: bool = True) -> XmlParserBackend:
+    """Build the configured parser backend; "auto" prefers lxml when it is installed
+    
+    Unknown or unavailable backends fall back to etree with a warning.
+    """
+    if name == "auto":
+        name = "lxml" if LxmlParser.available() else "etree"
+    backend = PARSER_BACKENDS.get(name)
+    if backend is None or not backend.available():
+        logging.warning(f"XML parser '{name}' is not available, using 'etree'")
+        backend = EtreeParser
+    return backend(max_depth, forbid_entities)
+
+
+def extract_invoice(xml_file: str, metadata_fields: Optional[Dict[str, str]] = None,
+                    optimize: bool = False, parser: Optional[XmlParserBackend] = None) -> Tuple[bytes, Optional[Dict[str, str]], Dict[str, float]]:
+    """Parse an invoice and decode its embedded PDF
+    
+    This is the CPU-bound part of process_file. It is a module-level function
+    so that it can also run in a worker process.
+    
+    Args:
+        xml_file: Path to the XML file
+        metadata_fields: Fields to extract for the metadata index, if any
+        optimize: Rewrite the decoded PDF with optimize_pdf
+        parser: XML parser backend; etree with default limits when omitted
+        
+    Returns:
+        Tuple of (PDF bytes, metadata or None, seconds spent per stage)
+    """
+    stage_times = {}
+    
+    # Parse XML
+    started = time.perf_counter()
+    root = (parser or EtreeParser()).parse(xml_file)
+    now = time.perf_counter()
+    stage_times["parse"] = now - started
+    started = now
+    
+    # Find embedded document node through the format profile's known path
+    profile = detect_format_profile(root)
+    if profile is not None:
+        embedded_doc = profile.find_attachment(root)
+    else:
+        # Unknown format: fall back to scanning every element
+        embedded_doc = None
+        for elem in root.iter():
+            # lxml also yields comments and processing instructions, whose tag is not a string
+            if isinstance(elem.tag, str) and elem.tag.endswith('EmbeddedDocumentBinaryObject'):
+                embedded_doc = elem
+                break
+    stage_times["lookup"] = time.perf_counter() - started
+    
+    if embedded_doc is None:
+        raise ConversionError("Dokumentā nav atrasts iegultais PDF fails", "missing_attachment")
+    
+    # Header fields for the search index come from the same parse
+    metadata = None
+    if metadata_fields:
+        started = time.perf_counter()
+        metadata = extract_metadata(root, metadata_fields)
+        stage_times["metadata"] = time.perf_counter() - started
+    
+    # Get binary data
+    base64_data = embedded_doc.text
+    if not base64_data:
+        raise ConversionError("Iegultajā dokumentā nav datu", "empty_attachment")
+    
+    # Decode Base64 data
+    started = time.perf_counter()
+    try:
+        binary_data = base64.b64decode(base64_data)
+    except Exception as e:
+        # Failed to decode Base64 data
+        raise ConversionError(f"Neizdevās dekodēt Base64 datus: {str(e)}", "base64")
+    stage_times["decode"] = time.perf_counter() - started
+    
+    # Optional rewrite; a PDF pikepdf cannot handle is kept as embedded
+    if optimize and pdf_optimizer_available():
+        started = time.perf_counter()
+        try:
+            binary_data = optimize_pdf(binary_data)
+        except Exception as e:
+            logging.warning(f"PDF optimisation skipped for {os.path.basename(xml_file)}: {str(e)}")
+        stage_times["optimize"] = time.perf_counter() - started
+    
+    return binary_data, metadata, stage_times
+
+
+def extract_invoices(xml_files: List[str], metadata_fields: Optional[Dict[str, str]] = None,
+                     optimize: bool = False, parser: Optional[XmlParserBackend] = None) -> List:
+    """Run extract_invoice for a chunk of files in one worker process task
+    
+    Returns:
+        One entry per file: the extract_invoice result, or the exception it raised
+    """
+    results = []
+    for xml_file in xml_files:
+        try:
+            results.append(extract_invoice(xml_file, metadata_fields, optimize, parser))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def pool_worker_ready() -> int:
+    """Trivial process pool task used to start the workers before a batch measures anything"""
+    return os.getpid()
+
+
+class TaskChunker:
+    """Groups small files into one worker task so per-task overhead is paid once per group
+    
+    Files above small_bytes always get a task of their own. The byte target for
+    a group starts at INITIAL_TARGET and is then tuned from the measured
+    overhead of a process pool round trip ("ipc") against the measured CPU time
+    per byte, so the overhead stays near OVERHEAD_SHARE of every task.
+    """
+    INITIAL_TARGET = 512 * 1024
+    OVERHEAD_SHARE = 0.05
+    
+    def __init__(self, small_bytes: int, max_files: int, max_bytes: int, measure: bool = False):
+        self.small_bytes = small_bytes
+        self.measure = measure  # Report task sizes even when chunking is off
+        self.max_files = max(1, max_files)
+        self.max_bytes = max(small_bytes, max_bytes)
+        self.target_bytes = min(self.INITIAL_TARGET, self.max_bytes)
+        self.bytes_done = 0
+        self.tasks = 0
+        self.chunked_tasks = 0
+        self.files_in_chunks = 0
+        self.largest_chunk = 0
+        self.overhead_seconds = None  # Per pool round trip, once measured
+        self._peeked = (None, 0)  # Size of the next pending file, looked up while building a chunk
+    
+    @property
+    def enabled(self) -> bool:
+        return self.small_bytes > 0 and self.max_files > 1
+    
+    def _size(self, path: str) -> int:
+        if self._peeked[0] == path:
+            return self._peeked[1]
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0  # Gone or unreadable; the worker reports it
+        self._peeked = (path, size)
+        return size
+    
+    def take(self, pending: List, chunk: bool = True) -> Tuple[List, int]:
+        """Pop the next task's items off the end of pending
+        
+        Args:
+            pending: Remaining items, the next one last
+            chunk: False to hand out a single file, e.g. while the process pool
+                takes no work and a chunk would run serially in one thread
+        
+        Returns:
+            Tuple of (items, total bytes of the files)
+        """
+        self.tasks += 1
+        if not self.enabled and not self.measure:
+            return [pending.pop()], 0
+        items = [pending.pop()]
+        total = self._size(items[0][0])
+        if chunk and self.enabled and total <= self.small_bytes:
+            while pending and len(items) < self.max_files:
+                size = self._size(pending[-1][0])
+                if size > self.small_bytes or total + size > self.target_bytes:
+                    break
+                items.append(pending.pop())
+                total += size
+        if len(items) > 1:
+            self.chunked_tasks += 1
+            self.files_in_chunks += len(items)
+            self.largest_chunk = max(self.largest_chunk, len(items))
+        return items, total
+    
+    def tune(self, timings: 'StageTimings', task_bytes: int):
+        """Recompute the byte target after a task finished"""
+        self.bytes_done += task_bytes
+        summary = timings.summary()
+        ipc = summary.get("ipc")
+        cpu_seconds = sum(summary[stage]["total_seconds"] for stage in WorkerAutoscaler.CPU_STAGES
+                          if stage in summary)
+        if not ipc or not self.bytes_done or cpu_seconds <= 0:
+            return
+        self.overhead_seconds = max(ipc["total_seconds"] / ipc["count"], 0.0)
+        seconds_per_byte = cpu_seconds / self.bytes_done
+        target = self.overhead_seconds / (self.OVERHEAD_SHARE * seconds_per_byte)
+        self.target_bytes = int(min(max(target, self.small_bytes), self.max_bytes))
+    
+    def summary(self) -> Dict:
+        """Chunking statistics for the batch"""
+        return {
+            "enabled": self.enabled,
+            "tasks": self.tasks,
+            "chunked_tasks": self.chunked_tasks,
+            "files_in_chunks": self.files_in_chunks,
+            "mean_files_per_chunk": round(self.files_in_chunks / self.chunked_tasks, 1) if self.chunked_tasks else 0,
+            "largest_chunk": self.largest_chunk,
+            "target_kb": round(self.target_bytes / 1024, 1),
+            "overhead_us_per_task": round(self.overhead_seconds * 1e6, 1) if self.overhead_seconds is not None else None
+        }
+
+
+class ConcurrencyLimit:
+    """Semaphore whose limit can be changed while it is in use"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition()
+    
+    def set_limit(self, limit: int):
+        """Change the number of holders allowed at once"""
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+    
+    def __enter__(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class WorkerAutoscaler:
+    """Chooses thread and process pool sizes from the converter's stage timings
+    
+    Every interval_files completions it compares time spent in CPU stages with
+    time spent in I/O stages and grows the pool that serves the dominant side.
+    A step that lowers throughput is undone and that pool stops growing for
+    the rest of the batch.
+    
+    Each pool task occupies a worker thread while it waits for its process, so
+    a process only adds parallelism while threads outnumber processes; growing
+    the process pool grows the threads along with it.
+    """
+    CPU_STAGES = ("parse", "lookup", "metadata", "decode", "optimize")
+    OVERHEAD_STAGES = ("prepare", "logging", "ipc")
+    MAX_ADJUSTMENTS = 50  # Adjustments kept for the batch summary
+    
+    def __init__(self, min_threads: int, max_threads: int, min_processes: int, max_processes: int,
+                 interval_files: int = 25):
+        self.min_threads = max(1, min_threads)
+        self.max_threads = max(self.min_threads, max_threads)
+        self.min_processes = max(0, min_processes)
+        self.max_processes = max(self.min_processes, max_processes)
+        self.interval_files = max(1, interval_files)
+        self.processes = self.min_processes
+        self.threads = min(max(self.min_threads, self.processes + 1 if self.processes else 0), self.max_threads)
+        self.peak_threads = self.threads
+        self.peak_processes = self.processes
+        self.adjustments = []
+        self._frozen = set()  # Pools whose last growth step didn't pay off
+        self._last_step = None  # (pool, threads before the step, processes before the step)
+        self._last_throughput = None
+        self._last_totals = {}
+        self._window_files = 0
+        self._window_start = time.perf_counter()
+    
+    def restart_window(self, timings: 'StageTimings'):
+        """Start measuring from now, e.g. after the process pool has been started"""
+        self._last_totals = timings.totals()
+        self._window_files = 0
+        self._window_start = time.perf_counter()
+    
+    def observe(self, timings: 'StageTimings') -> bool:
+        """Count one completed file
+        
+        Returns:
+            True when the thread or process pool size changed
+        """
+        self._window_files += 1
+        if self._window_files < self.interval_files:
+            return False
+        
+        now = time.perf_counter()
+        throughput = self._window_files / max(now - self._window_start, 1e-9)
+        totals = timings.totals()
+        delta = {stage: seconds - self._last_totals.get(stage, 0.0) for stage, seconds in totals.items()}
+        self._last_totals = totals
+        self._window_files = 0
+        self._window_start = now
+        
+        cpu_seconds = sum(delta.get(stage, 0.0) for stage in self.CPU_STAGES)
+        io_seconds = sum(seconds for stage, seconds in delta.items()
+                         if stage not in self.CPU_STAGES and stage not in self.OVERHEAD_STAGES)
+        
+        changed = False
+        if self._last_step and self._last_throughput and throughput < self._last_throughput * 0.95:
+            # The last step made things worse: undo it and stop growing that pool
+            pool, self.threads, self.processes = self._last_step
+            self._frozen.add(pool)
+            self._last_step = None
+            self._record("revert", pool, throughput)
+            changed = True
+        else:
+            pool = self._choose_pool(cpu_seconds, io_seconds)
+            if pool:
+                self._last_step = (pool, self.threads, self.processes)
+                if pool == "processes":
+                    self.processes += 1
+                    self.threads = max(self.threads, self.processes + 1)
+                else:
+                    self.threads += 1
+                self._record("grow", pool, throughput)
+                changed = True
+            else:
+                self._last_step = None
+        
+        self._last_throughput = throughput
+        self.peak_threads = max(self.peak_threads, self.threads)
+        self.peak_processes = max(self.peak_processes, self.processes)
+        return changed
+    
+    def _choose_pool(self, cpu_seconds: float, io_seconds: float) -> Optional[str]:
+        """Pick the pool to grow next, or None when nothing can grow"""
+        if (cpu_seconds > io_seconds and "processes" not in self._frozen
+                and self.processes < self.max_processes and self.processes + 1 < self.max_threads):
+            return "processes"
+        if "threads" not in self._frozen and self.threads < self.max_threads:
+            return "threads"
+        return None
+    
+    def _record(self, action: str, pool: str, throughput: float):
+        if len(self.adjustments) < self.MAX_ADJUSTMENTS:
+            self.adjustments.append({
+                "action": action,
+                "pool": pool,
+                "threads": self.threads,
+                "processes": self.processes,
+                "files_per_second": round(throughput, 1)
+            })
+    
+    def summary(self) -> Dict:
+        """Pool sizes chosen for the batch"""
+        return {
+            "threads": self.threads,
+            "processes": self.processes,
+            "peak_threads": self.peak_threads,
+            "peak_processes": self.peak_processes,
+            "adjustments": self.adjustments
+        }
+
+
+class MemoryBudget:
+    """Admission control that reserves each file's estimated memory footprint
+    
+    A file only starts once its estimate fits next to the files already in
+    flight. A file larger than the whole budget is admitted on its own. The
+    converter keeps one budget for all lanes, so batches running at the same
+    time share it; each batch reserves through a MemoryBudgetShare.
+    """
+    
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.reserved = 0
+        self._condition = threading.Condition()
+    
+    def resize(self, budget_bytes: int):
+        """Change the budget; waiting reservations are re-checked against it"""
+        with self._condition:
+            self.budget_bytes = budget_bytes
+            self._condition.notify_all()
+    
+    def reserve(self, nbytes: int) -> Tuple[bool, int]:
+        """Block until nbytes fit in the budget, then reserve them
+        
+        Returns:
+            (whether the reservation had to wait, total reserved afterwards)
+        """
+        with self._condition:
+            waited = False
+            while self.reserved and self.reserved + nbytes > self.budget_bytes:
+                waited = True
+                self._condition.wait()
+            self.reserved += nbytes
+            return waited, self.reserved
+    
+    def release(self, nbytes: int):
+        """Return a reservation once its file is finished"""
+        with self._condition:
+            self.reserved -= nbytes
+            self._condition.notify_all()
+
+
+class MemoryBudgetShare:
+    """One batch's reservations against the shared MemoryBudget, with the batch's own statistics"""
+    
+    def __init__(self, budget: MemoryBudget):
+        self.budget = budget
+        self.peak_reserved = 0  # Highest total reservation, all lanes included, seen by this batch
+        self.largest = 0
+        self.waits = 0
+    
+    def reserve(self, nbytes: int):
+        """Block until nbytes fit in the shared budget, then reserve them"""
+        waited, reserved = self.budget.reserve(nbytes)
+        self.waits += waited
+        self.peak_reserved = max(self.peak_reserved, reserved)
+        self.largest = max(self.largest, nbytes)
+    
+    def release(self, nbytes: int):
+        """Return a reservation once its file is finished"""
+        self.budget.release(nbytes)
+    
+    def summary(self) -> Dict:
+        """Budget, peak reservation and admission waits in MB"""
+        summary = {
+            "budget_mb": round(self.budget.budget_bytes / (1024 * 1024), 1),
+            "peak_reserved_mb": round(self.peak_reserved / (1024 * 1024), 1),
+            "largest_estimate_mb": round(self.largest / (1024 * 1024), 1),
+            "admission_waits": self.waits
+        }
+        if resource is not None:
+            # ru_maxrss is kilobytes on Linux and bytes on macOS
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+            summary["process_peak_rss_mb"] = round(peak_rss / divisor, 1)
+        return summary
+
+
+class ConverterMetrics:
+    """Counters, gauges and histograms exposed in the Prometheus text format
+    
+    Metrics live for the whole process, so unlike the per-batch statistics they
+    use one lock instead of per-thread counters, which would pile up as every
+    batch starts new worker threads.
+    """
+    
+    STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SIZE_BUCKETS = (10e3, 50e3, 100e3, 500e3, 1e6, 5e6, 10e6, 50e6)
+    LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+    
+    # name -> (type, help, label name, histogram buckets)
+    DEFINITIONS = {
+        "peppol_files_total": ("counter", "Files finished, by outcome", "outcome", None),
+        "peppol_failures_total": ("counter", "Failed files, by error category", "category", None),
+        "peppol_retries_total": ("counter", "Transient errors queued for another attempt", None, None),
+        "peppol_batches_total": ("counter", "Completed batches", None, None),
+        "peppol_queue_depth": ("gauge", "Files of the running batch waiting to start, including retries", "lane", None),
+        "peppol_in_flight": ("gauge", "Files currently being converted", "lane", None),
+        "peppol_worker_threads": ("gauge", "Worker threads the autoscaler allows", None, None),
+        "peppol_worker_processes": ("gauge", "Worker processes the autoscaler allows", None, None),
+        "peppol_last_batch_timestamp_seconds": ("gauge", "Unix time the last batch finished", None, None),
+        "peppol_stage_seconds": ("histogram", "Time spent per processing stage", "stage", STAGE_BUCKETS),
+        "peppol_pdf_bytes": ("histogram", "Size of extracted PDF payloads", None, SIZE_BUCKETS),
+        "peppol_lane_latency_seconds": ("histogram", "Time from submitting a batch to each file finishing, by lane",
+                                        "lane", LATENCY_BUCKETS),
+    }
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # (name, label value) -> number
+        self._histograms = {}  # (name, label value) -> [bucket counts, sum, count]
+    
+    def inc(self, name: str, label: str = "", amount: float = 1):
+        """Increase a counter"""
+        with self._lock:
+            self._values[(name, label)] = self._values.get((name, label), 0) + amount
+    
+    def set(self, name: str, value: float, label: str = ""):
+        """Set a gauge"""
+        with self._lock:
+            self._values[(name, label)] = value
+    
+    def observe(self, name: str, label: str, value: float):
+        """Add one sample to a histogram"""
+        buckets = self.DEFINITIONS[name][3]
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            histogram = self._histograms.get((name, label))
+            if histogram is None:
+                histogram = self._histograms[(name, label)] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+        
+        lines = []
+        for name, (kind, help_text, label_name, buckets) in self.DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for (metric, label), value in sorted(values.items()):
+                    if metric == name:
+                        labels = f'{{{label_name}="{label}"}}' if label_name else ""
+                        lines.append(f"{name}{labels} {value}")
+                continue
+            for (metric, label), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                prefix = f'{label_name}="{label}",' if label_name else ""
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+                labels = f"{{{prefix.rstrip(',')}}}" if prefix else ""
+                lines.append(f"{name}_sum{labels} {total}")
+                lines.append(f"{name}_count{labels} {count}")
+        return "\n".join(lines) + "\n"
+    
+    def write_textfile(self, path: str):
+        """Write the metrics for the node-exporter textfile collector
+        
+        The collector may read at any moment, so the file is replaced atomically.
+        """
+        temp_file = f"{path}.{os.getpid()}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temp_file, path)
+
+
+def _metrics_request_handler():
+    """Build the handler that serves ConverterMetrics.render() on /metrics
+    
+    Defined on demand so http.server is only imported when the endpoint is enabled.
+    """
+    class MetricsRequestHandler(http_server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = self.server.metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would flood the console
+            pass
+    
+    return MetricsRequestHandler
+
+
+class MetricsExporter:
+    """Publishes ConverterMetrics through a textfile and/or a local HTTP endpoint"""
+    
+    def __init__(self, metrics: ConverterMetrics, textfile: str = "", interval: float = 15,
+                 http_port: int = 0, http_host: str = "127.0.0.1"):
+        self.metrics = metrics
+        self.textfile = textfile
+        self.interval = interval
+        self._stop = threading.Event()
+        self._writer = None
+        self._server = None
+        
+        if http_port:
+            self._server = http_server.ThreadingHTTPServer((http_host, http_port), _metrics_request_handler())
+            self._server.daemon_threads = True
+            self._server.metrics = metrics
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            logging.info(f"Metrics available at http://{http_host}:{self._server.server_port}/metrics")
+        if textfile:
+            self._writer = threading.Thread(target=self._write_loop, name="metrics-textfile", daemon=True)
+            self._writer.start()
+    
+    def _write_loop(self):
+        while True:
+            self.write_now()
+            if self._stop.wait(self.interval):
+                break
+    
+    def write_now(self):
+        """Rewrite the textfile immediately, e.g. when a batch ends"""
+        if not self.textfile:
+            return
+        try:
+            self.metrics.write_textfile(self.textfile)
+        except OSError as e:
+            logging.warning(f"Could not write metrics textfile {self.textfile}: {str(e)}")
+    
+    def close(self):
+        """Stop the writer and the HTTP server, leaving a final textfile behind"""
+        self._stop.set()
+        if self._writer:
+            self._writer.join()
+            self.write_now()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+LANES = ("interactive", "bulk")
+
+
+class PriorityLanes:
+    """Lets interactive batches run ahead of bulk work
+    
+    While any interactive batch is running, bulk batches stop starting new
+    files; files they already have in flight finish normally. Bulk work picks
+    up again as soon as the last interactive batch ends.
+    """
+    
+    POLL_SECONDS = 0.25  # How often a yielding bulk batch rechecks its in-flight files
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.active = {lane: 0 for lane in LANES}
+    
+    def enter(self, lane: str):
+        """Register a running batch"""
+        with self._condition:
+            self.active[lane] += 1
+    
+    def leave(self, lane: str):
+        """Unregister a batch and wake waiting bulk batches"""
+        with self._condition:
+            self.active[lane] -= 1
+            self._condition.notify_all()
+    
+    def must_yield(self, lane: str) -> bool:
+        """Tell whether a batch in this lane should hold back new files"""
+        return lane == "bulk" and self.active["interactive"] > 0
+    
+    def wait_for_turn(self, lane: str, timeout: Optional[float] = None):
+        """Block until the lane may start files again or the timeout passes"""
+        with self._condition:
+            self._condition.wait_for(lambda: not self.must_yield(lane), timeout)
+
+
+class LaneLatency:
+    """Latency from batch submission to each file finishing, for one lane"""
+    
+    def __init__(self, lane: str, metrics: Optional[ConverterMetrics] = None):
+        self.lane = lane
+        self.metrics = metrics
+        self.submitted = time.perf_counter()
+        self.count = 0
+        self.total = 0.0
+        self.first = None
+        self.max = 0.0
+    
+    def record(self):
+        """Record one finished file; called from the dispatching thread only"""
+        latency = time.perf_counter() - self.submitted
+        self.count += 1
+        self.total += latency
+        if self.first is None:
+            self.first = latency
+        self.max = max(self.max, latency)
+        if self.metrics:
+            self.metrics.observe("peppol_lane_latency_seconds", self.lane, latency)
+    
+    def summary(self) -> Dict:
+        """Return files, first/mean/max latency in milliseconds"""
+        return {
+            "lane": self.lane,
+            "files": self.count,
+            "first_ms": round((self.first or 0.0) * 1000, 1),
+            "mean_ms": round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 1)
+        }
+
+
+TRACE_SETTINGS = (
+    "worker_threads_min", "worker_threads_max", "worker_processes_min", "worker_processes_max",
+    "autoscale_interval_files", "memory_budget_mb", "memory_estimate_factor", "durability_mode",
+    "output_mode", "output_layout", "output_collision", "pdf_optimize", "chunk_small_file_kb",
+    "chunk_max_files", "chunk_max_kb", "retry_max_attempts", "retry_base_seconds", "retry_max_seconds"
+)
+
+
+class TraceRecorder:
+    """Records the shape of production batches so their performance can be replayed offline
+    
+    One JSON line per batch start (arrival offset, lane, file sizes in arrival
+    order, performance settings), per file (outcome, error class, start offset,
+    seconds per stage) and per batch end. File names and contents are never
+    written. One trace file is kept per converter session.
+    """
+    
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, f"trace_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jsonl")
+        self._file = open(self.path, 'x', encoding='utf-8')
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.batches = 0
+    
+    def write(self, record: Dict):
+        """Append one record and flush it, so a crash still leaves a usable trace"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+    
+    def start_batch(self, files: List[str], lane: str, settings: Dict) -> "BatchTrace":
+        """Record a batch arriving and return the handle its files are recorded with"""
+        with self._lock:
+            self.batches += 1
+            batch = self.batches
+        sizes = []
+        for path in files:
+            try:
+                sizes.append(os.stat(path).st_size)
+            except OSError:
+                sizes.append(0)
+        trace = BatchTrace(self, batch, files, sizes)
+        self.write({
+            "type": "batch",
+            "batch": batch,
+            "offset": round(trace.started - self.started, 6),
+            "started_at": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "lane": lane,
+            "sizes": sizes,
+            "settings": settings
+        })
+        return trace
+    
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class BatchTrace:
+    """Trace records of one batch; file records refer to files by arrival order"""
+    
+    def __init__(self, recorder: TraceRecorder, batch: int, files: List[str], sizes: List[int]):
+        self.recorder = recorder
+        self.batch = batch
+        self.started = time.perf_counter()
+        # Claiming and retries change a file's directory, never its name
+        self.arrival = {os.path.basename(path): (seq, size) for seq, (path, size) in enumerate(zip(files, sizes))}
+    
+    def record_file(self, filename: str, attempt: int, outcome: str, category: Optional[str] = None,
+                    started: Optional[float] = None, stages: Optional[Dict[str, float]] = None):
+        """Record how one attempt at a file ended"""
+        seq, size = self.arrival.get(filename, (-1, 0))
+        now = time.perf_counter()
+        started = started if started is not None else now
+        self.recorder.write({
+            "type": "file",
+            "batch": self.batch,
+            "seq": seq,
+            "size": size,
+            "attempt": attempt,
+            "outcome": outcome,
+            "category": category,
+            "start": round(started - self.started, 6),
+            "seconds": round(now - started, 6),
+            "stages": {stage: round(seconds, 6) for stage, seconds in (stages or {}).items()}
+        })
+    
+    def finish(self, stats: Dict):
+        """Record the batch totals"""
+        self.recorder.write({
+            "type": "batch_end",
+            "batch": self.batch,
+            "elapsed": round(time.perf_counter() - self.started, 6),
+            "processed": stats["processed"],
+            "success": stats["success"],
+            "failed": stats["failed"],
+            "skipped": stats["skipped"],
+            "retries": stats["retries"],
+            "workers": stats.get("workers"),
+            "chunks": stats.get("chunks"),
+            "stages": {stage: round(timing["total_seconds"], 6) for stage, timing in stats["stage_timings"].items()}
+        })
+
+
+class BatchContext:
+    """Settings resolved once per batch so process_file does no per-file setup"""
+    
+    def __init__(self, output_dir: Optional[str], failed_dir: Optional[str], durability: str = "none"):
+        self.output_dir = output_dir  # None means "next to the source XML"
+        self.failed_dir = failed_dir  # None means failed files stay in place
+        self.durability = durability
+        self.pending_sync = []  # Files written in "batch" mode, synced at batch end
+        self.touched_dirs = set()  # Directories to sync at batch end
+        self.archive = None  # ArchiveWriter when output_mode is "zip"
+        self.metadata_index = None  # MetadataIndex when metadata indexing is enabled
+        self.owns_metadata_index = False  # Index opened for this batch only, closed in finish_batch
+        self.pinned = False  # Counted in PeppolConverter.active_batches until finish_batch
+        self.metadata_fields = {}
+        self.layout = None  # OutputLayout when output_layout is not "flat"
+        self.extract_fields = None  # Metadata and layout fields read during the parse
+        self.optimize_pdf = False  # Run optimize_pdf on every decoded PDF
+        self.parser = EtreeParser()  # XML parser backend with the configured limits
+        self.failure_index = None  # FailureIndex of failed_dir
+        self.names = OutputNames()  # Collision handling for output and failed file names
+        self.process_pool = None  # ProcessPoolExecutor for extract_invoice, if configured
+        self.process_limit = ConcurrencyLimit(0)  # Extractions allowed in the pool at once
+        self.trace = None  # BatchTrace when trace_directory is configured
+        self.timings = StageTimings()
+
+
+class PeppolConverter:
+    """Converts PEPPOL XML files with embedded PDFs to standalone PDF files"""
+    
+    def __init__(self, config_manager: ConfigManager):
+        self.config = config_manager
+        self.log_manager = None  # Will be set externally
+        self.stats = {
+            "processed": 0,
+            "success": 0,
+            "failed": 0,
+            "start_time": datetime.datetime.now()
+        }
+        self.claimers = {}  # input directory -> FileClaimer
+        self._claimers_lock = threading.Lock()
+        self.metadata_index = None  # Opened on first use, kept across batches
+        self.failure_index = None  # FailureIndex of the failed directory, loaded on first use
+        self.output_layout = None  # OutputLayout, kept so created directories stay cached
+        self.output_names = None  # OutputNames shared by the batches running at the same time
+        self.trace_recorder = None  # TraceRecorder, opened with the first traced batch
+        self.process_pool = None  # Created on first use, kept across batches
+        self.process_pool_size = 0
+        self.memory_budget = None  # MemoryBudget shared by all lanes, created on first use
+        self.active_batches = 0  # Batches between prepare_batch_context and finish_batch
+        self._shared_lock = threading.Lock()  # Guards replacing the pool and index batches share
+        self.metrics = ConverterMetrics()
+        self.metrics_exporter = self.start_metrics_exporter()
+        self.lanes = PriorityLanes()
+    
+    def start_metrics_exporter(self) -> Optional[MetricsExporter]:
+        """Publish metrics as configured, or return None when no exporter is enabled"""
+        textfile = self.config.get("metrics_textfile", "")
+        http_port = self.config.get("metrics_http_port", 0)
+        if not textfile and not http_port:
+            return None
+        try:
+            return MetricsExporter(
+                self.metrics,
+                os.path.abspath(textfile) if textfile else "",
+                self.config.get("metrics_interval_seconds", 15),
+                http_port,
+                self.config.get("metrics_http_host", "127.0.0.1")
+            )
+        except OSError as e:
+            logging.error(f"Failed to start metrics exporter: {str(e)}")
+            return None
+    
+    def set_log_manager(self, log_manager):
+        """Set the log manager instance"""
+        self.log_manager = log_manager
+
+    def prepare_batch_context(self) -> BatchContext:
+        """Resolve directories, create them and register namespaces once for a batch"""
+        # Register namespaces for XPath
+        for prefix, uri in NAMESPACES.items():
+            ET.register_namespace(prefix, uri)
+        
+        output_dir = self.config.get("output_directory")
+        if output_dir:
+            output_dir = os.path.abspath(output_dir)
+            os.makedirs(output_dir, exist_ok=True)
+        else:
+            output_dir = None
+        
+        failed_dir = self.config.get("failed_directory")
+        if failed_dir and failed_dir.strip():
+            failed_dir = os.path.abspath(failed_dir)
+            os.makedirs(failed_dir, exist_ok=True)
+        else:
+            logging.warning(f"Failed directory not configured or empty: '{failed_dir}'")
+            failed_dir = None
+        
+        durability = self.config.get("durability_mode", "none")
+        if durability not in DURABILITY_MODES:
+            logging.warning(f"Unknown durability mode '{durability}', using 'none'")
+            durability = "none"
+        
+        context = BatchContext(output_dir, failed_dir, durability)
+        if failed_dir:
+            context.failure_index = self.get_failure_index(failed_dir)
+        
+        output_mode = self.config.get("output_mode", "files")
+        if output_mode == "zip":
+            if output_dir:
+                context.archive = ArchiveWriter(
+                    output_dir,
+                    self.config.get("archive_max_members", 10000),
+                    self.config.get("archive_max_mb", 512),
+                    durability
+                )
+            else:
+                logging.warning("Archive output needs an output directory, writing plain files instead")
+        elif output_mode not in OUTPUT_MODES:
+            logging.warning(f"Unknown output mode '{output_mode}', writing plain files")
+        
+        layout = self.config.get("output_layout", "flat")
+        if layout not in OUTPUT_LAYOUTS:
+            logging.warning(f"Unknown output layout '{layout}', writing all files to the output directory")
+        elif layout != "flat" and not context.archive:
+            if output_dir:
+                context.layout = self.get_output_layout(output_dir, layout)
+            else:
+                logging.warning("Output layout needs an output directory, writing PDFs next to the source files")
+        
+        # Lanes run batches concurrently; the shared pool and index stay put while others use them
+        with self._shared_lock:
+            self.active_batches += 1
+        context.pinned = True
+        context.metadata_index = self.get_metadata_index(context)
+        
+        collision = self.config.get("output_collision", "suffix")
+        if collision not in COLLISION_STRATEGIES:
+            logging.warning(f"Unknown output collision strategy '{collision}', using 'suffix'")
+            collision = "suffix"
+        context.names = self.get_output_names(collision)
+        if context.metadata_index:
+            context.metadata_fields = self.config.get("metadata_fields") or DEFAULT_METADATA_FIELDS
+        fields = dict(context.metadata_fields)
+        if context.layout:
+            fields.update(context.layout.fields())
+        context.extract_fields = fields or None
+        
+        context.parser = create_parser_backend(
+            self.config.get("xml_parser", "auto"),
+            self.config.get("xml_max_depth", 256),
+            self.config.get("xml_forbid_entities", True)
+        )
+        
+        if self.config.get("pdf_optimize", False):
+            if pdf_optimizer_available():
+                context.optimize_pdf = True
+            else:
+                logging.warning("pdf_optimize is set but pikepdf is not installed, writing PDFs as embedded")
+        
+        return context
+    
+    def get_failure_index(self, failed_dir: str) -> FailureIndex:
+        """Return the failure index of a failed directory, kept across batches"""
+        if self.failure_index is None or self.failure_index.directory != failed_dir:
+            self.failure_index = FailureIndex(failed_dir)
+        return self.failure_index
+    
+    def get_output_layout(self, output_dir: str, layout: str) -> OutputLayout:
+        """Return the layout resolver for the output directory, kept across batches"""
+        current = self.output_layout
+        if current is None or current.root != output_dir or current.layout != layout:
+            self.output_layout = OutputLayout(output_dir, layout)
+        return self.output_layout
+    
+    def get_output_names(self, strategy: str) -> OutputNames:
+        """Return the name registry for a batch, shared with the batches running alongside it
+        
+        A batch that runs alone starts a fresh registry, so directories are
+        listed again and files removed in the meantime free their names.
+        """
+        with self._shared_lock:
+            if self.output_names is not None and self.active_batches > 1:
+                if self.output_names.strategy != strategy:
+                    logging.warning(f"Output collision strategy '{strategy}' applies once running batches finish")
+                return self.output_names
+            self.output_names = OutputNames(strategy)
+            return self.output_names
+    
+    def get_trace_recorder(self) -> Optional[TraceRecorder]:
+        """Return the recorder for the configured trace directory, or None when tracing is off"""
+        trace_dir = self.config.get("trace_directory", "")
+        if not trace_dir:
+            return None
+        trace_dir = os.path.abspath(trace_dir)
+        if self.trace_recorder is None or self.trace_recorder.directory != trace_dir:
+            if self.trace_recorder:
+                self.trace_recorder.close()
+            try:
+                self.trace_recorder = TraceRecorder(trace_dir)
+            except OSError as e:
+                logging.error(f"Failed to start trace in {trace_dir}: {str(e)}")
+                self.trace_recorder = None
+        return self.trace_recorder
+    
+    def get_metadata_index(self, context: BatchContext) -> Optional[MetadataIndex]:
+        """Return the configured metadata index for a batch, reopening it if the path changed
+        
+        The shared index is only closed when no other batch is using it. Until
+        then a batch that needs a different path gets an index of its own.
+        """
+        index_path = self.config.get("metadata_index_path")
+        if not index_path:
+            return None
+        index_path = os.path.abspath(index_path)
+        with self._shared_lock:
+            current = self.metadata_index
+            if current is not None and current.path == index_path:
+                return current
+            try:
+                index = MetadataIndex(index_path)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to open metadata index {index_path}: {str(e)}")
+                return None
+            if current is not None and self.active_batches > 1:
+                context.owns_metadata_index = True
+                return index
+            if current:
+                current.close()
+            self.metadata_index = index
+            return index
+    
+    def finish_batch(self, context: BatchContext):
+        """Complete deferred per-batch work: close archives and "batch" durability syncing"""
+        if context.metadata_index:
+            started = time.perf_counter()
+            try:
+                context.metadata_index.flush()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to update metadata index: {str(e)}")
+            context.timings.add("metadata_index", time.perf_counter() - started)
+        
+        if context.archive:
+            started = time.perf_counter()
+            try:
+                context.archive.close()
+            except OSError as e:
+                logging.error(f"Failed to finish archive: {str(e)}")
+            context.timings.add("archive_close", time.perf_counter() - started)
+            context.archive = None
+        
+        if context.owns_metadata_index:
+            try:
+                context.metadata_index.close()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to close metadata index: {str(e)}")
+            context.owns_metadata_index = False
+        if context.pinned:
+            context.pinned = False
+            with self._shared_lock:
+                self.active_batches -= 1
+        
+        if context.durability != "batch":
+            return
+        
+        started = time.perf_counter()
+        for path in context.pending_sync:
+            try:
+                fsync_file(path)
+            except OSError as e:
+                logging.error(f"Failed to sync {path}: {str(e)}")
+        for directory in context.touched_dirs:
+            try:
+                fsync_directory(directory)
+            except OSError as e:
+                logging.error(f"Failed to sync directory {directory}: {str(e)}")
+        context.timings.add("batch_sync", time.perf_counter() - started)
+        context.pending_sync = []
+        context.touched_dirs = set()
+
+    def get_claimer(self, file_path: str) -> Optional[FileClaimer]:
+        """Return the claimer for a file in the shared input directory, if claiming applies"""
+        input_dir = self.config.get("input_directory")
+        if not input_dir or not self.config.get("claim_input_files", True):
+            return None
+        input_dir = os.path.abspath(input_dir)
+        if os.path.dirname(os.path.abspath(file_path)) != input_dir:
+            return None
+        
+        with self._claimers_lock:
+            claimer = self.claimers.get(input_dir)
+            if claimer is None:
+                claimer = FileClaimer(input_dir, self.config.get("claim_stale_seconds", 3600))
+                claimer.recover_stale_claims()
+                self.claimers[input_dir] = claimer
+        return claimer
+    
+    def heartbeat_claims(self):
+        """Keep our claim directories alive while idle, so other instances do not recover them"""
+        with self._claimers_lock:
+            claimers = list(self.claimers.values())
+        for claimer in claimers:
+            claimer.heartbeat_if_due()
+    
+    def release_claims(self):
+        """Hand back claimed files and remove claim directories on shutdown"""
+        with self._claimers_lock:
+            for claimer in self.claimers.values():
+                claimer.close()
+            self.claimers = {}
+    
+    def get_memory_budget(self, budget_bytes: int) -> MemoryBudget:
+        """Return the memory budget all lanes reserve from, set to the configured size"""
+        with self._shared_lock:
+            if self.memory_budget is None:
+                self.memory_budget = MemoryBudget(budget_bytes)
+            elif self.memory_budget.budget_bytes != budget_bytes:
+                self.memory_budget.resize(budget_bytes)
+            return self.memory_budget
+    
+    def get_process_pool(self, size: int):
+        """Return the shared process pool for extract_invoice, resizing it if needed
+        
+        A pool another batch is still using is kept at its size; the resize
+        happens with the first batch that runs alone.
+        """
+        with self._shared_lock:
+            if self.process_pool is None or (self.process_pool_size != size and self.active_batches <= 1):
+                if self.process_pool:
+                    self.process_pool.shutdown(wait=True)
+                # Spawn rather than fork: workers start while other threads may hold locks
+                self.process_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=size, mp_context=multiprocessing.get_context("spawn"))
+                self.process_pool_size = size
+                # Workers start lazily; start them all now instead of inside the first measurement
+                warm_up = [self.process_pool.submit(pool_worker_ready) for _ in range(size)]
+                concurrent.futures.wait(warm_up)
+            return self.process_pool
+    
+    def shutdown(self):
+        """Release claims and close pools and indexes when the application exits"""
+        self.release_claims()
+        if self.process_pool:
+            self.process_pool.shutdown(wait=True, cancel_futures=True)
+            self.process_pool = None
+        if self.metadata_index:
+            self.metadata_index.close()
+            self.metadata_index = None
+        if self.metrics_exporter:
+            self.metrics_exporter.close()
+            self.metrics_exporter = None
+        if self.trace_recorder:
+            self.trace_recorder.close()
+            self.trace_recorder = None
+
+    def _move_to_failed_dir(self, xml_file, error_msg, context: BatchContext, source_dir: Optional[str] = None,
+                            category: str = "unexpected"):
+        """Move a file to the failed directory, index why, and return appropriate response tuple"""
+        filename = os.path.basename(xml_file)
+        
+        # Log the error
+        logging.error(error_msg)
+        if self.log_manager:
+            started = time.perf_counter()
+            self.log_manager.log_error(filename, error_msg)
+            context.timings.add("log_file", time.perf_counter() - started)
+        
+        # Move to failed directory if configured
+        if context.failed_dir:
+            failed_path = os.path.join(context.failed_dir, filename)
+            started = time.perf_counter()
+            try:
+                if os.path.dirname(os.path.abspath(xml_file)) == context.failed_dir:
+                    # Reprocessed from the failed directory: it stays where it is
+                    failed_path = xml_file
+                else:
+                    failed_name, identical = context.names.claim(context.failed_dir, filename, xml_file)
+                    failed_path = os.path.join(context.failed_dir, failed_name)
+                    if identical:
+                        # The same file already failed earlier; keep one copy
+                        os.remove(xml_file)
+                    else:
+                        shutil.move(xml_file, failed_path)
+                    if failed_name != filename:
+                        logging.info(f"{filename} stored in the failed directory as {failed_name}")
+                    filename = failed_name
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Moved failed file to: {failed_path}")
+            except FileNotFoundError:
+                logging.warning(f"Original file no longer exists at: {xml_file}")
+            except Exception as move_err:
+                logging.error(f"Failed to move failed file: {str(move_err)}, Error type: {type(move_err).__name__}")
+                logging.debug(f"Move error details: {traceback.format_exc()}")
+                try:
+                    shutil.copy2(xml_file, failed_path)
+                    logging.info(f"Copied failed file to: {context.failed_dir} (move failed)")
+                except Exception as copy_err:
+                    logging.error(f"Failed to copy failed file as fallback: {str(copy_err)}")
+            now = time.perf_counter()
+            context.timings.add("move", now - started)
+            
+            # Keep the reason next to the file so reprocessing can be selective
+            if context.failure_index and os.path.exists(failed_path):
+                try:
+                    context.failure_index.record(filename, category, error_msg)
+                except OSError as e:
+                    logging.warning(f"Could not update failure index for {filename}: {str(e)}")
+                started, now = now, time.perf_counter()
+                context.timings.add("failure_index", now - started)
+            
+            if context.durability == "strict":
+                try:
+                    fsync_directory(context.failed_dir)
+                except OSError as e:
+                    logging.warning(f"Failed to sync directory {context.failed_dir}: {str(e)}")
+                context.timings.add("fsync", time.perf_counter() - now)
+            elif context.durability == "batch":
+                context.touched_dirs.add(context.failed_dir)
+        elif source_dir:
+            # Claimed file with nowhere to go: put it back where it came from
+            try:
+                shutil.move(xml_file, os.path.join(source_dir, filename))
+            except Exception as move_err:
+                logging.error(f"Failed to return file to {source_dir}: {str(move_err)}")
+        
+        return False, error_msg
+    
+    def process_file(self, xml_file: str, context: Optional[BatchContext] = None) -> Tuple[bool, str]:
+        """Process a single XML file to extract embedded PDF
+        
+        Args:
+            xml_file: Path to the XML file
+            context: Prepared batch context; one is created when omitted
+        
+        Returns:
+            Tuple[bool, str]: (success, message)
+        """
+        if context is not None:
+            success, message, _ = self._process_one(xml_file, context)
+            return success, message
+        
+        context = self.prepare_batch_context()
+        try:
+            success, message, _ = self._process_one(xml_file, context)
+        finally:
+            # A one-file batch: close its archive and do its deferred syncing
+            self.finish_batch(context)
+        return success, message
+    
+    def _process_one(self, xml_file: str, context: BatchContext, source_dir: Optional[str] = None,
+                     allow_retry: bool = False, extracted=None) -> Tuple[bool, str, Optional[str]]:
+        """Process a single XML file and report the error category on failure
+        
+        Args:
+            xml_file: Path to the XML file
+            context: Prepared batch context
+            source_dir: Directory the file was claimed from, if it was claimed
+            allow_retry: Leave the file in place on a transient error instead of failing it
+            extracted: extract_invoice result (or the exception it raised) when the
+                file was extracted as part of a chunk
+        
+        Returns:
+            Tuple[bool, str, Optional[str]]: (success, message, error category);
+            the category is RETRY_CATEGORY when the caller should try again later
+        """
+        filename = os.path.basename(xml_file)
+        timings = context.timings
+        committed = False  # Set once the output exists; from then on a retry would redo half the work
+        try:
+            # Per-file console logging is only emitted when debugging
+            started = time.perf_counter()
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"Processing {filename}")
+            timings.add("logging", time.perf_counter() - started)
             
-            # Get binary data
-            base64_data = embedded_doc.text
-            if not base64_data:
-                error_msg = "Iegultajā dokumentā nav datu"  
-                return self._move_to_failed_dir(xml_file, error_msg)
+            # Parse and decode, in a worker process when the process pool is in use
+            fields = context.extract_fields
+            if isinstance(extracted, Exception):
+                raise extracted
+            if extracted is not None:
+                binary_data, metadata, stage_times = extracted
+            elif context.process_pool is not None and context.process_limit.limit > 0:
+                with context.process_limit:
+                    started = time.perf_counter()
+                    binary_data, metadata, stage_times = context.process_pool.submit(
+                        extract_invoice, xml_file, fields, context.optimize_pdf, context.parser).result()
+                    timings.add("ipc", time.perf_counter() - started - sum(stage_times.values()))
+            else:
+                binary_data, metadata, stage_times = extract_invoice(xml_file, fields, context.optimize_pdf,
+                                                                     context.parser)
+            for stage, seconds in stage_times.items():
+                timings.add(stage, seconds)
+            if self.metrics:
+                self.metrics.observe("peppol_pdf_bytes", "", len(binary_data))
             
-            # Decode Base64 data
-            try:
-                binary_data = base64.b64decode(base64_data)
-            except Exception as e:
-                error_msg = f"Neizdevās dekodēt Base64 datus: {str(e)}"  # Failed to decode Base64 data
-                return self._move_to_failed_dir(xml_file, error_msg)
+            # The layout's field travels with the metadata but is not indexed
+            layout_value = metadata.pop(OutputLayout.FIELD, None) if metadata is not None else None
+            if not context.metadata_index:
+                metadata = None
             
             # Determine output PDF filename and path
-            output_dir = self.config.get("output_directory")
-            if not output_dir:
-                output_dir = os.path.dirname(xml_file)
-            
-            # Ensure output directory exists
-            os.makedirs(output_dir, exist_ok=True)
+            output_dir = context.output_dir or source_dir or os.path.dirname(xml_file)
+            if context.layout:
+                started = time.perf_counter()
+                output_dir, created = context.layout.directory(filename, layout_value)
+                if created and context.durability == "strict":
+                    for directory in context.layout.parents(output_dir):
+                        try:
+                            fsync_directory(directory)
+                        except OSError as e:
+                            logging.warning(f"Failed to sync directory {directory}: {str(e)}")
+                elif created and context.durability == "batch":
+                    context.touched_dirs.update(context.layout.parents(output_dir))
+                timings.add("layout", time.perf_counter() - started)
             
             # Create PDF filename from XML filename
             pdf_filename = os.path.splitext(filename)[0] + ".pdf"
+            
+            if context.archive:
+                started = time.perf_counter()
+                location = context.archive.add(pdf_filename, binary_data)
+                timings.add("archive", time.perf_counter() - started)
+                committed = True
+                result = self._archive_result(xml_file, location, context)
+                if metadata is not None:
+                    self._index_metadata(context, result[1], filename, metadata)
+                return result
+            
+            # Resolve name collisions against the shared listing of the directory
+            started = time.perf_counter()
+            pdf_filename, pdf_file = self._create_output(context, output_dir, pdf_filename, binary_data)
             pdf_path = os.path.join(output_dir, pdf_filename)
+            now = time.perf_counter()
+            timings.add("names", now - started)
+            started = now
             
-            # Write PDF file
-            with open(pdf_path, 'wb') as pdf_file:
-                pdf_file.write(binary_data)
-
-            # Mark as successful processing
-            success_flag = True
+            # Write PDF file, unless the same PDF is already there
+            if pdf_file is None:
+                logging.info(f"{pdf_filename} already exists with the same content, not written again")
+            else:
+                with pdf_file:
+                    pdf_file.write(binary_data)
+                    if context.durability == "strict":
+                        pdf_file.flush()
+                        now = time.perf_counter()
+                        timings.add("write", now - started)
+                        started = now
+                        os.fsync(pdf_file.fileno())
+                now = time.perf_counter()
+                timings.add("fsync" if context.durability == "strict" else "write", now - started)
+                started = now
+                if context.durability == "batch":
+                    context.pending_sync.append(pdf_path)
+                    context.touched_dirs.add(output_dir)
+            committed = True
 
             # Log success with custom format if enabled
             if self.log_manager:
                 self.log_manager.log_success(filename)
+                now = time.perf_counter()
+                timings.add("log_file", now - started)
+                started = now
 
-            # Move the original XML file to the output directory at the very end
-            if os.path.exists(xml_file):
-                xml_output_path = os.path.join(output_dir, filename)
-                try:
-                    shutil.move(xml_file, xml_output_path)
-                    logging.info(f"Moved original XML file to: {xml_output_path}")
-                except Exception as move_err:
-                    logging.warning(f"Failed to move original XML file: {str(move_err)}")
-                    # Try to copy if move fails
-                    try:
-                        shutil.copy2(xml_file, xml_output_path)
-                        logging.info(f"Copied original XML file to: {xml_output_path} (move failed)")
-                    except Exception as copy_err:
-                        logging.error(f"Failed to copy original XML file as fallback: {str(copy_err)}")
-            else:
+            # Move the original XML file to the output directory at the very end,
+            # named after its PDF
+            xml_output_path = os.path.join(output_dir, filename)
+            try:
+                if os.path.abspath(xml_file) != os.path.abspath(xml_output_path):
+                    xml_name = os.path.splitext(pdf_filename)[0] + os.path.splitext(filename)[1]
+                    xml_name, identical = context.names.claim(output_dir, xml_name, xml_file, derived=True)
+                    xml_output_path = os.path.join(output_dir, xml_name)
+                    if identical:
+                        os.remove(xml_file)
+                    else:
+                        shutil.move(xml_file, xml_output_path)
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Moved original XML file to: {xml_output_path}")
+            except FileNotFoundError:
                 logging.warning(f"Original file no longer exists at: {xml_file}")
-
-            return True, pdf_path
+            except Exception as move_err:
+                logging.warning(f"Failed to move original XML file: {str(move_err)}")
+                # Try to copy if move fails
+                try:
+                    shutil.copy2(xml_file, xml_output_path)
+                    logging.info(f"Copied original XML file to: {xml_output_path} (move failed)")
+                except Exception as copy_err:
+                    logging.error(f"Failed to copy original XML file as fallback: {str(copy_err)}")
+            now = time.perf_counter()
+            timings.add("move", now - started)
             
-            # Log success with custom format if enabled
-            if self.log_manager:
-                self.log_manager.log_success(filename)
+            # Strict durability: the PDF and the moved XML are on disk before we report success.
+            # Both are already in place, so a failed sync must not send the file to failed
+            if context.durability == "strict":
+                try:
+                    fsync_directory(output_dir)
+                except OSError as e:
+                    logging.warning(f"Failed to sync directory {output_dir}: {str(e)}")
+                timings.add("fsync", time.perf_counter() - now)
             
-            return True, pdf_path
+            if metadata is not None:
+                self._index_metadata(context, pdf_path, filename, metadata)
+
+            return True, pdf_path, None
             
         except Exception as e:
-            error_msg = f"Error processing {os.path.basename(xml_file)}: {str(e)}"
-            logging.error(error_msg)
-            
-            # Log the error
-            if self.log_manager:
-                self.log_manager.log_error(os.path.basename(xml_file), error_msg)
-            
-            # Move to failed directory if configured
-            failed_dir = self.config.get("failed_directory")
-            logging.info(f"Failed directory from config: '{failed_dir}'")
-            logging.info(f"Original file exists before move: {os.path.exists(xml_file)}")
-            logging.info(f"Original file path type: {type(xml_file)}")
-            
-            if failed_dir and failed_dir.strip():
-                # Ensure we have an absolute path
-                failed_dir = os.path.abspath(failed_dir)
-                logging.info(f"Using failed directory absolute path: {failed_dir}")
-                
-                # Check if directory exists
-                if not os.path.exists(failed_dir):
-                    logging.info(f"Creating failed directory: {failed_dir}")
-                    os.makedirs(failed_dir, exist_ok=True)
-                
-                # Double check directory exists
-                logging.info(f"Failed directory exists after creation: {os.path.exists(failed_dir)}")
-                
-                try:
-                    failed_path = os.path.join(failed_dir, os.path.basename(xml_file))
-                    logging.info(f"Target failed path: {failed_path}")
-                    # Check if target already exists
-                    if os.path.exists(failed_path):
-                        logging.warning(f"Target file already exists, will be overwritten: {failed_path}")
-                        
-                    # Try to move the file
-                    logging.info(f"Attempting to move failed file from {xml_file} to {failed_path}")
-                    shutil.move(xml_file, failed_path)
-                    
-                    # Check if move succeeded
-                    if os.path.exists(failed_path):
-                        logging.info(f"Successfully moved failed file to: {failed_path}")
-                    else:
-                        logging.error(f"Move appeared to succeed but file not found at destination: {failed_path}")
-                        
-                except Exception as move_err:
-                    logging.error(f"Failed to move failed file: {str(move_err)}, Error type: {type(move_err).__name__}")
-                    # Get more details about the error
-                    logging.error(f"Move error details: {traceback.format_exc()}")
-                    
-                    # Try to copy if move fails
-                    try:
-                        logging.info(f"Attempting to copy instead to: {os.path.join(failed_dir, os.path.basename(xml_file))}")
-                        shutil.copy2(xml_file, os.path.join(failed_dir, os.path.basename(xml_file)))
-                        logging.info(f"Copied failed file to: {failed_dir} (move failed)")
-                    except Exception as copy_err:
-                        logging.error(f"Failed to copy failed file as fallback: {str(copy_err)}, Error type: {type(copy_err).__name__}")
-                        logging.error(f"Copy error details: {traceback.format_exc()}")
+            if isinstance(e, ConversionError):
+                error_msg = str(e)
             else:
-                logging.warning(f"Failed directory not configured or empty: '{failed_dir}'")
-            
-            return False, error_msg
+                error_msg = f"Error processing {filename}: {str(e)}"
+            if allow_retry and not committed and is_transient_error(e):
+                # Keep the file where it is; the batch queues it for another attempt
+                logging.warning(f"Transient error, will retry: {error_msg}")
+                return False, error_msg, RETRY_CATEGORY
+            category = classify_error(e)
+            success, message = self._move_to_failed_dir(xml_file, error_msg, context, source_dir, category)
+            return success, message, category
+    
+    def _create_output(self, context: BatchContext, output_dir: str, pdf_filename: str,
+                       binary_data: bytes) -> Tuple[str, Optional[IO]]:
+        """Claim a name for a PDF and create the file exclusively
+        
+        A file that appeared after the directory was listed, e.g. one written
+        by another instance, makes the create fail; the name is then claimed
+        again, which moves on to the next free name or finds identical content.
+        
+        Returns:
+            (file name, file opened for writing, or None when an identical file already has the name)
+        """
+        mode = 'wb' if context.names.strategy == "overwrite" else 'xb'
+        while True:
+            name, identical = context.names.claim(output_dir, pdf_filename, binary_data)
+            if identical:
+                return name, None
+            path = os.path.join(output_dir, name)
+            try:
+                try:
+                    return name, open(path, mode)
+                except FileNotFoundError:
+                    if not context.layout:
+                        raise
+                    # The cached layout directory was removed (e.g. by a cleanup job); once is enough
+                    logging.warning(f"Output directory {output_dir} was removed, creating it again")
+                    context.layout.recreate(output_dir)
+                    return name, open(path, mode)
+            except FileExistsError:
+                continue  # The claim recorded the name, so the next claim skips it
+    
+    def _index_metadata(self, context: BatchContext, output_path: str, filename: str, metadata: Dict[str, str]):
+        """Queue a converted invoice for the metadata index
+        
+        The output is already committed at this point, so an index error is only
+        logged; the rows stay queued and are written with the next flush.
+        """
+        try:
+            context.metadata_index.add(output_path, filename, metadata)
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to update metadata index for {filename}: {str(e)}")
+    
+    def _archive_result(self, xml_file: str, location: str,
+                        context: BatchContext) -> Tuple[bool, str, Optional[str]]:
+        """Append the source XML to the batch archive after its PDF, found at location"""
+        filename = os.path.basename(xml_file)
+        timings = context.timings
+        
+        started = time.perf_counter()
+        with open(xml_file, 'rb') as f:
+            context.archive.add(filename, f.read(), compress=True)
+        now = time.perf_counter()
+        timings.add("archive", now - started)
+        started = now
+        
+        if self.log_manager:
+            self.log_manager.log_success(filename)
+            now = time.perf_counter()
+            timings.add("log_file", now - started)
+            started = now
+        
+        # The XML now lives in the archive
+        os.remove(xml_file)
+        timings.add("move", time.perf_counter() - started)
+        return True, location, None
+    
+    def _run_task(self, items: List[Tuple[str, int, Optional[str]]], context: BatchContext,
+                  batch_stats: BatchStats) -> List[Tuple[str, int, Optional[str]]]:
+        """Worker task: claim one file or a chunk of small files, convert them and record the outcomes
+        
+        Args:
+            items: (file, attempt, source_dir) per file. On a retry the file is the
+                already claimed path and source_dir the directory it was claimed from;
+                attempt counts earlier attempts that hit a transient error.
+        
+        Returns:
+            (file, attempt, source_dir) of every file to queue for a retry
+        """
+        # Files in the shared input directory are claimed first so that
+        # other instances watching the same share skip them
+        trace = context.trace
+        claimed = []
+        for file, attempt, source_dir in items:
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"About to process file: {file}")
+            try:
+                claimer = self.get_claimer(file) if attempt == 0 else None
+                if claimer:
+                    claimed_path = claimer.claim(file)
+                    if claimed_path is None:
+                        batch_stats.record_skipped(os.path.basename(file))
+                        if trace:
+                            trace.record_file(os.path.basename(file), attempt, "skipped")
+                        continue
+                    file, source_dir = claimed_path, claimer.directory
+                claimed.append((file, attempt, source_dir))
+            except Exception as e:
+                self._record_unexpected(os.path.basename(file), e, batch_stats)
+        
+        # A chunk goes to the process pool as a single task
+        extracted = [None] * len(claimed)
+        if len(claimed) > 1 and context.process_pool is not None and context.process_limit.limit > 0:
+            extracted = self._extract_chunk([file for file, _, _ in claimed], context)
+        
+        retries = []
+        max_attempts = self.config.get("retry_max_attempts", 3)
+        for (file, attempt, source_dir), result in zip(claimed, extracted):
+            filename = os.path.basename(file)
+            if trace:
+                started = time.perf_counter()
+                context.timings.begin_capture()
+            try:
+                success, message, category = self._process_one(
+                    file, context, source_dir, attempt < max_attempts, result)
+                if success:
+                    batch_stats.record_success(filename, message, retried=attempt > 0)
+                    outcome = "success"
+                elif category == RETRY_CATEGORY:
+                    batch_stats.record_retry(filename)
+                    retries.append((file, attempt, source_dir))
+                    outcome = "retry"
+                else:
+                    batch_stats.record_failure(filename, message, category)
+                    outcome = "failed"
+            except Exception as e:
+                self._record_unexpected(filename, e, batch_stats)
+                outcome, category = "failed", "unexpected"
+            if trace:
+                trace.record_file(filename, attempt, outcome, category, started, context.timings.end_capture())
+        return retries
+    
+    def _extract_chunk(self, files: List[str], context: BatchContext) -> List:
+        """Extract a chunk of files with one process pool round trip"""
+        fields = context.extract_fields
+        with context.process_limit:
+            started = time.perf_counter()
+            try:
+                results = context.process_pool.submit(
+                    extract_invoices, files, fields, context.optimize_pdf, context.parser).result()
+            except Exception as e:
+                # The pool itself failed (e.g. a worker died); each file reports it
+                return [e] * len(files)
+            elapsed = time.perf_counter() - started
+        work = sum(sum(result[2].values()) for result in results if not isinstance(result, Exception))
+        context.timings.add("ipc", elapsed - work)
+        return results
+    
+    def _record_unexpected(self, filename: str, error: Exception, batch_stats: BatchStats):
+        """Record a failure that escaped process_file's own error handling"""
+        error_msg = f"Unexpected error: {str(error)}"
+        batch_stats.record_failure(filename, error_msg, "unexpected")
+        
+        # Log the error
+        if self.log_manager:
+            self.log_manager.log_error(filename, error_msg)
     
-    def process_batch(self, files: List[str], progress_callback=None) -> Dict:
+    def open_batch_report(self) -> Optional[BatchReport]:
+        """Start the on-disk report for a batch, or None when reports are disabled"""
+        report_format = self.config.get("batch_report_format", "jsonl")
+        if not report_format:
+            return None
+        if self.log_manager and self.log_manager.LOG_FILE:
+            log_dir = os.path.dirname(self.log_manager.LOG_FILE)
+        else:
+            log_dir = self.config.get("log_directory") or os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "logs")
+        report_dir = os.path.join(log_dir, "batch_reports")
+        BatchReport.prune(report_dir, max(self.config.get("batch_report_keep", 50) - 1, 0))
+        try:
+            return BatchReport(report_dir, report_format)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Batch report disabled: {str(e)}")
+            return None
+    
+    def process_batch(self, files: List[str], progress_callback=None, interactive: bool = True,
+                      lane: Optional[str] = None) -> Dict:
         """Process a batch of files with optional progress reporting
         
         Args:
             files: List of file paths to process
             progress_callback: Optional callback function for progress updates
+            interactive: Open the PDF / show a dialog when a single file is processed
+            lane: "interactive" or "bulk"; defaults to the lane matching interactive.
+                Bulk batches pause while an interactive batch is running.
             
         Returns:
             Dict with processing statistics
         """
-        self.stats = {
-            "processed": 0,
-            "success": 0,
-            "failed": 0,
-            "start_time": datetime.datetime.now(),
-            "failed_files": [],
-            "success_files": []
-        }
+        if lane is None:
+            lane = "interactive" if interactive else "bulk"
+        latency = LaneLatency(lane, self.metrics)
+        start_time = datetime.datetime.now()
+        # Pick up settings another instance saved; a single stat when unchanged
+        self.config.reload_if_changed()
+        report = self.open_batch_report()
+        batch_stats = BatchStats(self.config.get("stats_max_samples", 200), report, self.metrics)
         
         total_files = len(files)
+        completed = 0
+        started = time.perf_counter()
+        context = self.prepare_batch_context()
+        context.timings.add("prepare", time.perf_counter() - started)
+        context.timings.metrics = self.metrics
+        recorder = self.get_trace_recorder()
+        if recorder:
+            context.trace = recorder.start_batch(
+                files, lane, {key: self.config.get(key, ConfigManager.DEFAULT_CONFIG[key]) for key in TRACE_SETTINGS})
         
-        # Process files sequentially
-        for i, file in enumerate(files):
-            filename = os.path.basename(file)
-            
-            # Verify file is accessible
-            logging.info(f"About to process file: {file}")
-            logging.info(f"File exists: {os.path.exists(file)}")
-            
-            try:
-                success, message = self.process_file(file)
-                self.stats["processed"] += 1
-                
-                if success:
-                    self.stats["success"] += 1
-                    self.stats.setdefault("success_files", []).append((filename, message))
-                else:
-                    self.stats["failed"] += 1
-                    self.stats.setdefault("failed_files", []).append((filename, message))
+        scaler = WorkerAutoscaler(
+            self.config.get("worker_threads_min", 1),
+            self.config.get("worker_threads_max", 4),
+            self.config.get("worker_processes_min", 0),
+            self.config.get("worker_processes_max", 0),
+            self.config.get("autoscale_interval_files", 25)
+        )
+        if scaler.max_processes > 0:
+            context.process_pool = self.get_process_pool(scaler.max_processes)
+            context.process_limit.set_limit(scaler.processes)
+            # Worker start-up is not part of what the autoscaler should measure
+            scaler.restart_window(context.timings)
+        
+        # Tree, base64 text and decoded PDF all live at once, so each file
+        # reserves a multiple of its size before it may start
+        budget_mb = self.config.get("memory_budget_mb", 512)
+        budget = MemoryBudgetShare(self.get_memory_budget(int(budget_mb * 1024 * 1024))) if budget_mb else None
+        estimate_factor = self.config.get("memory_estimate_factor", 2.5)
+        
+        # Files that hit a transient error wait here, ordered by when they are due
+        retry_base = self.config.get("retry_base_seconds", 1.0)
+        retry_max = self.config.get("retry_max_seconds", 30.0)
+        retry_queue = []  # (due time, sequence, file, attempt, source_dir)
+        retry_seq = 0
+        
+        # Small files travel to the process pool in chunks to amortise the round trip
+        chunker = TaskChunker(
+            int(self.config.get("chunk_small_file_kb", 100) * 1024) if scaler.max_processes > 0 else 0,
+            self.config.get("chunk_max_files", 32),
+            int(self.config.get("chunk_max_kb", 4096) * 1024),
+            measure=budget is not None
+        )
+        
+        # Hand files to the thread pool, never keeping more in flight than the
+        # autoscaler currently allows
+        pending = [(file, 0, None) for file in reversed(files)]
+        in_flight = {}  # future -> (files in the task, bytes in the task)
+        self.lanes.enter(lane)
+        try:
+            with ThreadPoolExecutor(max_workers=scaler.max_threads) as pool:
+                while pending or in_flight or retry_queue:
+                    # Due retries go back in front of the remaining new files
+                    now = time.monotonic()
+                    while retry_queue and retry_queue[0][0] <= now:
+                        _, _, file, attempt, source_dir = heapq.heappop(retry_queue)
+                        pending.append((file, attempt, source_dir))
                     
-            except Exception as e:
-                self.stats["processed"] += 1
-                self.stats["failed"] += 1
-                error_msg = f"Unexpected error: {str(e)}"
-                self.stats.setdefault("failed_files", []).append((filename, error_msg))
-                
-                # Log the error
-                if self.log_manager:
-                    self.log_manager.log_error(filename, error_msg)
-            
-            # Update progress
-            if progress_callback:
-                progress_callback(self.stats["processed"], total_files)
+                    # Bulk work holds back new files while interactive files are waiting
+                    yielding = self.lanes.must_yield(lane)
+                    while pending and not yielding and len(in_flight) < scaler.threads:
+                        items, task_bytes = chunker.take(pending, context.process_limit.limit > 0)
+                        reservation = int(task_bytes * estimate_factor)
+                        if budget:
+                            budget.reserve(reservation)
+                        future = pool.submit(self._run_task, items, context, batch_stats)
+                        if budget:
+                            future.add_done_callback(lambda _, size=reservation: budget.release(size))
+                        in_flight[future] = (len(items), task_bytes)
+                    
+                    metrics = self.metrics
+                    metrics.set("peppol_queue_depth", len(pending) + len(retry_queue), lane)
+                    metrics.set("peppol_in_flight", sum(files for files, _ in in_flight.values()), lane)
+                    metrics.set("peppol_worker_threads", scaler.threads)
+                    metrics.set("peppol_worker_processes", scaler.processes)
+                    
+                    # Never sleep past the next retry, so waiting files do not hold up the rest
+                    timeout = max(retry_queue[0][0] - time.monotonic(), 0) if retry_queue else None
+                    if not in_flight:
+                        if yielding:
+                            self.lanes.wait_for_turn(lane, timeout)
+                        else:
+                            time.sleep(timeout)
+                        continue
+                    if yielding:
+                        timeout = min(timeout, PriorityLanes.POLL_SECONDS) if timeout is not None else PriorityLanes.POLL_SECONDS
+                    done, _ = concurrent.futures.wait(in_flight, timeout=timeout,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        file_count, task_bytes = in_flight.pop(future)
+                        retries = future.result()
+                        for file, attempt, source_dir in retries:
+                            retry_seq += 1
+                            due = time.monotonic() + retry_delay(attempt + 1, retry_base, retry_max)
+                            heapq.heappush(retry_queue, (due, retry_seq, file, attempt + 1, source_dir))
+                        if chunker.enabled:
+                            chunker.tune(context.timings, task_bytes)
+                        for _ in range(file_count - len(retries)):
+                            completed += 1
+                            latency.record()
+                            if scaler.observe(context.timings):
+                                context.process_limit.set_limit(scaler.processes)
+                    
+                    # Update progress
+                    if progress_callback:
+                        progress_callback(completed, total_files)
+        
+        finally:
+            self.lanes.leave(lane)
+            self.finish_batch(context)
+        
+        self.metrics.set("peppol_queue_depth", 0, lane)
+        self.metrics.set("peppol_in_flight", 0, lane)
+        self.metrics.inc("peppol_batches_total")
+        self.metrics.set("peppol_last_batch_timestamp_seconds", time.time())
+        if self.metrics_exporter:
+            self.metrics_exporter.write_now()
         
-        # Calculate elapsed time
-        self.stats["end_time"] = datetime.datetime.now()
-        self.stats["elapsed_seconds"] = (self.stats["end_time"] - self.stats["start_time"]).total_seconds()
+        # Merge worker counters and calculate elapsed time
+        stats = batch_stats.merge()
+        stats["start_time"] = start_time
+        stats["end_time"] = datetime.datetime.now()
+        stats["elapsed_seconds"] = (stats["end_time"] - start_time).total_seconds()
+        stats["stage_timings"] = context.timings.summary()
+        stats["durability_mode"] = context.durability
+        stats["workers"] = scaler.summary()
+        stats["latency"] = latency.summary()
+        stats["chunks"] = chunker.summary()
+        if budget:
+            stats["memory"] = budget.summary()
+        if report:
+            report.close()
+            stats["report"] = report.info()
+        if context.trace:
+            context.trace.finish(stats)
+            stats["trace"] = context.trace.recorder.path
+        self.stats = stats
         
         # Standard logging of batch summary
-        logging.info(f"Batch processing complete. Processed: {self.stats['processed']}, "
-                    f"Success: {self.stats['success']}, Failed: {self.stats['failed']}")
+        logging.info(f"Batch processing complete. Processed: {stats['processed']}, "
+                    f"Success: {stats['success']}, Failed: {stats['failed']}, "
+                    f"Skipped (claimed elsewhere): {stats['skipped']}, "
+                    f"Retries: {stats['retries']} ({stats['recovered']} recovered), "
+                    f"Lane: {lane}, mean latency {stats['latency']['mean_ms']} ms, "
+                    f"Workers: {scaler.threads} threads, {scaler.processes} processes")
         
         # If only one file was processed
-        if len(files) == 1:
+        if interactive and len(files) == 1:
             filename = os.path.basename(files[0])
             
             # If processed successfully, open the PDF and show success message
-            if self.stats["success"] == 1 and self.stats["success_files"]:
-                pdf_path = self.stats["success_files"][0][1]
+            if stats["success"] == 1 and stats["success_files"]:
+                pdf_path = stats["success_files"][0][1]
                 if os.path.exists(pdf_path) and pdf_path.lower().endswith('.pdf'):
                     self.open_pdf_file(pdf_path)
                     # Show success message
@@ -619,15 +4148,15 @@ class PeppolConverter:
                         logging.info("Could not show success message dialog")
             
             # If processing failed, show error message
-            elif self.stats["failed"] == 1 and self.stats["failed_files"]:
-                error_message = self.stats["failed_files"][0][1]
+            elif stats["failed"] == 1 and stats["failed_files"]:
+                error_message = stats["failed_files"][0][1]
                 try:
                     import tkinter.messagebox as messagebox
                     messagebox.showerror("Error", f"Failed to process file '{filename}'.\n\nError: {error_message}")
                 except:
                     logging.error(f"Could not show error message dialog")
         
-        return self.stats
+        return stats
     
     def open_pdf_file(self, pdf_path):
         """Open the PDF file with the default system viewer"""
@@ -667,6 +4196,7 @@ class ConverterGUI:
         self.drag_files = []
         self.currently_processing = False
         self.processing_thread = None
+        self.bulk_thread = None  # Background conversion of the hot folder
         
         # Create the notebook (tabbed interface)
         self.notebook = ttk.Notebook(root)
@@ -683,8 +4213,16 @@ class ConverterGUI:
         # Periodically check log rotation
         self.check_log_rotation()
         
-        # Check directory locks for currently configured directories
-        self.check_directory_locks()
+        # Check directory locks for currently configured directories once the
+        # user and PC names are known, so a slow lookup never holds up the first frame
+        self._lock_check_deadline = time.monotonic() + HostIdentity.WAIT_SECONDS
+        self.root.after(100, self.check_directory_locks_when_ready)
+        
+        # Keep our presence records fresh while the application runs
+        self.heartbeat_directory_locks()
+        
+        # Convert files arriving in the input directory in the bulk lane
+        self.poll_hot_folder()
         
         # Setup application exit handler
         self.root.protocol("WM_DELETE_WINDOW", self.on_exit)
@@ -728,6 +4266,19 @@ class ConverterGUI:
         status_label = ttk.Label(progress_frame, textvariable=self.status_var)
         status_label.pack(padx=10, pady=5)
         
+        # Background (bulk lane) processing of the input directory
+        bulk_frame = ttk.Frame(progress_frame)
+        bulk_frame.pack(fill='x', padx=10, pady=5)
+        self.hot_folder_var = tk.BooleanVar(value=self.config_manager.get("hot_folder_enabled", False))
+        ttk.Checkbutton(
+            bulk_frame,
+            text="Apstrādāt ievades direktoriju fonā",  # Process the input directory in the background
+            variable=self.hot_folder_var,
+            command=self.toggle_hot_folder
+        ).pack(side=tk.LEFT)
+        self.bulk_status_var = tk.StringVar(value="")
+        ttk.Label(bulk_frame, textvariable=self.bulk_status_var).pack(side=tk.RIGHT)
+        
         # Files list
         files_frame = ttk.LabelFrame(converter_frame, text="Izvēlētie Faili")  # Selected Files
         files_frame.pack(fill='both', expand=True, padx=10, pady=10)
@@ -803,7 +4354,7 @@ class ConverterGUI:
         self.notebook.add(log_frame, text="Žurnāli")  # Logs
         
         # Create log viewer
-        self.log_viewer = ScrolledText(log_frame, wrap=tk.WORD)
+        self.log_viewer = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD)
         self.log_viewer.pack(fill='both', expand=True, padx=10, pady=10)
         
         # Buttons frame
@@ -964,6 +4515,60 @@ class ConverterGUI:
             # Re-enable UI
             self.root.after(0, lambda: setattr(self, 'currently_processing', False))
     
+    def toggle_hot_folder(self):
+        """Enable or disable background processing of the input directory"""
+        self.config_manager.set("hot_folder_enabled", self.hot_folder_var.get())
+        if self.hot_folder_var.get():
+            self.poll_hot_folder(reschedule=False)
+    
+    def poll_hot_folder(self, reschedule: bool = True):
+        """Periodically hand new files in the input directory to the bulk lane"""
+        if reschedule:
+            interval = self.config_manager.get("hot_folder_interval_seconds", 30)
+            self.root.after(int(max(interval, 1) * 1000), self.poll_hot_folder)
+        
+        if not self.config_manager.get("hot_folder_enabled", False):
+            return
+        self.converter.heartbeat_claims()
+        if self.bulk_thread and self.bulk_thread.is_alive():
+            return  # The previous scan is still being converted
+        input_dir = self.config_manager.get("input_directory")
+        if not input_dir or not os.path.isdir(input_dir):
+            return
+        try:
+            files = list_input_files(input_dir)
+        except OSError as e:
+            logging.warning(f"Could not scan input directory {input_dir}: {str(e)}")
+            return
+        if not files:
+            return
+        
+        self.bulk_status_var.set(f"Fonā: 0/{len(files)}")  # In the background
+        self.bulk_thread = threading.Thread(target=self.run_bulk_processing, args=(files,))
+        self.bulk_thread.daemon = True
+        self.bulk_thread.start()
+    
+    def run_bulk_processing(self, files):
+        """Convert hot folder files in the bulk lane; interactive drops run ahead of it"""
+        try:
+            stats = self.converter.process_batch(
+                files,
+                progress_callback=self.update_bulk_progress,
+                interactive=False,
+                lane="bulk"
+            )
+            self.root.after(0, lambda: self.bulk_status_var.set(
+                f"Fonā pabeigts: {stats['success']} veiksmīgi, {stats['failed']} neveiksmīgi"  # Background done: succeeded, failed
+            ))
+            self.root.after(0, self.refresh_logs)
+        except Exception as e:
+            logging.error(f"Background processing error: {str(e)}")
+            self.root.after(0, lambda: self.bulk_status_var.set(f"Fona kļūda: {str(e)}"))  # Background error
+    
+    def update_bulk_progress(self, current, total):
+        """Update the background status from the bulk processing thread"""
+        self.root.after(0, lambda: self.bulk_status_var.set(f"Fonā: {current}/{total}"))  # In the background
+    
     def update_progress(self, current, total):
         """Update progress bar from the processing thread"""
         progress = (current / total) * 100 if total > 0 else 0
@@ -988,26 +4593,42 @@ class ConverterGUI:
             font=("Arial", 12, "bold")
         ).pack(anchor='w')
         
+        if stats.get('retries'):
+            ttk.Label(
+                header_frame,
+                text=f"Atkārtoti mēģinājumi: {stats['retries']}, no tiem izdevās: {stats['recovered']}"  # Retries, of which recovered
+            ).pack(anchor='w')
+        
         # Create a notebook for success/failed tabs
         summary_notebook = ttk.Notebook(summary_window)
         summary_notebook.pack(fill='both', expand=True, padx=10, pady=10)
         
+        report = stats.get("report")
+        
         # Success tab
         success_frame = ttk.Frame(summary_notebook)
         summary_notebook.add(success_frame, text=f"Veiksmīgi ({stats['success']})")  # Successful
         
         if stats['success'] > 0:
-            # Create a scrollable list
-            success_list = tk.Listbox(success_frame)
-            success_scrollbar = ttk.Scrollbar(success_frame, orient="vertical", command=success_list.yview)
-            success_list.configure(yscrollcommand=success_scrollbar.set)
-            
-            success_list.pack(side=tk.LEFT, fill='both', expand=True)
-            success_scrollbar.pack(side=tk.RIGHT, fill='y')
-            
-            # Add success files to list
-            for idx, (filename, path) in enumerate(stats['success_files'], 1):
-                success_list.insert(tk.END, f"{idx}. {filename}")
+            if report:
+                self._build_report_pager(success_frame, report, "success")
+            else:
+                # Create a scrollable list
+                success_list = tk.Listbox(success_frame)
+                success_scrollbar = ttk.Scrollbar(success_frame, orient="vertical", command=success_list.yview)
+                success_list.configure(yscrollcommand=success_scrollbar.set)
+                
+                success_list.pack(side=tk.LEFT, fill='both', expand=True)
+                success_scrollbar.pack(side=tk.RIGHT, fill='y')
+                
+                # Add success files to list
+                for idx, (filename, path) in enumerate(stats['success_files'], 1):
+                    success_list.insert(tk.END, f"{idx}. {filename}")
+                
+                # Only a bounded sample of file names is kept for large batches
+                not_listed = stats['success'] - len(stats['success_files'])
+                if not_listed > 0:
+                    success_list.insert(tk.END, f"... un vēl {not_listed} faili")  # ... and N more files
         else:
             ttk.Label(success_frame, text="Neviens fails netika apstrādāts veiksmīgi.").pack(padx=20, pady=20)  # No files were processed successfully
         
@@ -1016,17 +4637,27 @@ class ConverterGUI:
         summary_notebook.add(failed_frame, text=f"Neveiksmīgi ({stats['failed']})")  # Failed
         
         if stats['failed'] > 0:
-            # Create a scrollable text widget for failed files with error messages
-            failed_text = ScrolledText(failed_frame, wrap=tk.WORD)
-            failed_text.pack(fill='both', expand=True)
-            
-            # Add failed files with error messages
-            for idx, (filename, error) in enumerate(stats['failed_files'], 1):
-                failed_text.insert(tk.END, f"{idx}. {filename}\n")
-                failed_text.insert(tk.END, f"   Kļūda: {error}\n\n")  # Error
-            
-            # Disable editing
-            failed_text.config(state=tk.DISABLED)
+            if report:
+                self._build_report_pager(failed_frame, report, "failed")
+            else:
+                # Create a scrollable text widget for failed files with error messages
+                failed_text = scrolledtext.ScrolledText(failed_frame, wrap=tk.WORD)
+                failed_text.pack(fill='both', expand=True)
+                
+                # Add failed files with error messages
+                for idx, (filename, error) in enumerate(stats['failed_files'], 1):
+                    failed_text.insert(tk.END, f"{idx}. {filename}\n")
+                    failed_text.insert(tk.END, f"   Kļūda: {error}\n\n")  # Error
+                
+                # Only a bounded sample is kept, so summarise the rest by category
+                not_listed = stats['failed'] - len(stats['failed_files'])
+                if not_listed > 0:
+                    failed_text.insert(tk.END, f"... un vēl {not_listed} faili\n")  # ... and N more files
+                    for category, count in sorted(stats['failed_by_category'].items()):
+                        failed_text.insert(tk.END, f"   {category}: {count}\n")
+                
+                # Disable editing
+                failed_text.config(state=tk.DISABLED)
         else:
             ttk.Label(failed_frame, text="Neviens fails neizgāja apstrādi.").pack(padx=20, pady=20)  # No files failed processing
         
@@ -1041,6 +4672,44 @@ class ConverterGUI:
         if stats['failed'] > 0:
             summary_notebook.select(1)  # Select failed tab if there are failures
     
+    def _build_report_pager(self, parent, report, outcome):
+        """Show a batch report one page at a time, reading each page from disk on demand"""
+        pages = BatchReport.page_count(report, outcome)
+        page_size = report["page_size"]
+        current = {"page": 0}
+        
+        nav_frame = ttk.Frame(parent)
+        nav_frame.pack(side=tk.BOTTOM, fill='x', pady=5)
+        text = scrolledtext.ScrolledText(parent, wrap=tk.WORD)
+        text.pack(fill='both', expand=True)
+        page_label = ttk.Label(nav_frame)
+        
+        def show(page):
+            current["page"] = page
+            try:
+                records = BatchReport.read_page(report, outcome, page)
+            except (OSError, ValueError) as e:
+                records = []
+                logging.error(f"Could not read batch report: {str(e)}")
+            text.config(state=tk.NORMAL)
+            text.delete("1.0", tk.END)
+            for idx, (filename, message, category) in enumerate(records, page * page_size + 1):
+                text.insert(tk.END, f"{idx}. {filename}\n")
+                if outcome == "failed":
+                    text.insert(tk.END, f"   Kļūda ({category}): {message}\n\n")  # Error
+            text.config(state=tk.DISABLED)
+            page_label.config(text=f"Lapa {page + 1}/{pages}")  # Page x/y
+            prev_btn.config(state=tk.NORMAL if page > 0 else tk.DISABLED)
+            next_btn.config(state=tk.NORMAL if page + 1 < pages else tk.DISABLED)
+        
+        prev_btn = ttk.Button(nav_frame, text="< Iepriekšējā", command=lambda: show(current["page"] - 1))  # Previous
+        next_btn = ttk.Button(nav_frame, text="Nākamā >", command=lambda: show(current["page"] + 1))  # Next
+        prev_btn.pack(side=tk.LEFT, padx=5)
+        page_label.pack(side=tk.LEFT, expand=True)
+        next_btn.pack(side=tk.RIGHT, padx=5)
+        ttk.Label(nav_frame, text=os.path.basename(report["paths"][outcome])).pack(side=tk.LEFT, padx=5)
+        show(0)
+    
     def clear_file_list(self):
         """Clear the file list after processing"""
         self.drag_files = []
@@ -1130,40 +4799,36 @@ class ConverterGUI:
                         return
             
             # Now continue with the original save_configuration logic
-            # Update config from UI values
-            self.config_manager.set("input_directory", new_input_dir)
-            self.config_manager.set("output_directory", new_output_dir)
-            self.config_manager.set("failed_directory", new_failed_dir)
-            self.config_manager.set("log_directory", new_log_dir)
-            logging.info(f"Saving directories: Input='{new_input_dir}', Output='{new_output_dir}', Failed='{new_failed_dir}', Log='{new_log_dir}'")
-            
-            # Parse numeric values
+            # Parse numeric values before anything is stored
             try:
                 log_max_size = float(self.log_size_var.get())
                 log_max_lines = int(self.log_lines_var.get())
-                
-                self.config_manager.set("log_max_size_mb", log_max_size)
-                self.config_manager.set("log_max_lines", log_max_lines)
-                
-                # Update the log manager directly
-                if hasattr(self, 'log_manager') and self.log_manager:
-                    self.log_manager.MAX_LOG_SIZE = log_max_size
-                    self.log_manager.MAX_LOG_RECORDS = log_max_lines
-                
             except ValueError:
                 messagebox.showwarning("Nederīga Vērtība", "Skaitliskajām vērtībām jābūt veseliem skaitļiem")  # Invalid Value
                 return
-            
-            # Save log successful files setting
             log_success = self.log_success_var.get()
-            self.config_manager.set("log_successful_files", log_success)
+            
+            logging.info(f"Saving directories: Input='{new_input_dir}', Output='{new_output_dir}', Failed='{new_failed_dir}', Log='{new_log_dir}'")
             
             # Update the log manager directly
             if hasattr(self, 'log_manager') and self.log_manager:
+                self.log_manager.MAX_LOG_SIZE = log_max_size
+                self.log_manager.MAX_LOG_RECORDS = log_max_lines
                 self.log_manager.LOG_SUCCESS = log_success
             
-            # Save config
-            if self.config_manager.save_config():
+            # Update config from UI values with a single write
+            saved = self.config_manager.update({
+                "input_directory": new_input_dir,
+                "output_directory": new_output_dir,
+                "failed_directory": new_failed_dir,
+                "log_directory": new_log_dir,
+                "log_max_size_mb": log_max_size,
+                "log_max_lines": log_max_lines,
+                "log_successful_files": log_success
+            })
+            
+            # Report the outcome of the save
+            if saved:
                 messagebox.showinfo("Veiksmīgi", "Konfigurācija saglabāta veiksmīgi")  # Success
                 
                 # Update log manager settings
@@ -1228,6 +4893,19 @@ class ConverterGUI:
         # Check again after 5 minutes
         self.root.after(300000, self.check_log_rotation)
     
+    def heartbeat_directory_locks(self):
+        """Periodically refresh presence records in the tracked directories"""
+        self.lock_manager.heartbeat()
+        self.root.after(DirectoryLockManager.HEARTBEAT_SECONDS * 1000, self.heartbeat_directory_locks)
+    
+    def check_directory_locks_when_ready(self):
+        """Run check_directory_locks once the host lookup is done, polling without blocking the event loop"""
+        if not HostIdentity.ready() and time.monotonic() < self._lock_check_deadline:
+            self.root.after(100, self.check_directory_locks_when_ready)
+            return
+        HostIdentity.get(0)  # Never waits; falls back to UNKNOWN if the lookup is still running
+        self.check_directory_locks()
+    
     def check_directory_locks(self):
         """Check if any of the configured directories are locked by another user"""
         # Check input directory
@@ -1263,29 +4941,648 @@ class ConverterGUI:
         if hasattr(self, 'lock_manager'):
             self.lock_manager.release_all_locks()
         
+        # Hand back claimed input files and stop worker processes
+        self.converter.shutdown()
+        
+        # Write out queued log entries
+        self.log_manager.close()
+        
         # Close the application
         self.root.destroy()
                                     
 
+def synthetic_invoice_xml(invoice_id: str, payload: bytes, wrap: bool = False) -> bytes:
+    """Build a minimal UBL invoice embedding the given payload as a PDF attachment
+    
+    With wrap the base64 text is broken into 76 character lines, as many
+    sending systems do, which the parser sees as thousands of text chunks.
+    """
+    encoded = (base64.encodebytes if wrap else base64.b64encode)(payload).decode('ascii')
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2" '
+        f'xmlns:cbc="{NAMESPACES["cbc"]}" xmlns:cac="{NAMESPACES["cac"]}">\n'
+        f'<cbc:ID>{invoice_id}</cbc:ID>\n'
+        f'<cbc:IssueDate>{datetime.date.today().isoformat()}</cbc:IssueDate>\n'
+        '<cac:AdditionalDocumentReference><cbc:ID>1</cbc:ID><cac:Attachment>'
+        '<cbc:EmbeddedDocumentBinaryObject mimeCode="application/pdf" filename="invoice.pdf">'
+        f'{encoded}'
+        '</cbc:EmbeddedDocumentBinaryObject></cac:Attachment></cac:AdditionalDocumentReference>\n'
+        '</Invoice>\n'
+    ).encode('utf-8')
+
+
+def synthetic_payload(size_bytes: int) -> bytes:
+    """Random PDF-like payload that makes a synthetic invoice roughly size_bytes long"""
+    # Base64 inflates by 4/3, so size the payload to hit the requested file size
+    payload_size = max(16, (size_bytes - 700) * 3 // 4)
+    return b"%PDF-1.4\n" + os.urandom(payload_size) + b"\n%%EOF\n"
+
+
+def write_synthetic_invoices(directory: str, count: int, size_bytes: int) -> List[str]:
+    """Write count synthetic invoices of roughly size_bytes each and return their paths"""
+    os.makedirs(directory, exist_ok=True)
+    payload = synthetic_payload(size_bytes)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"bench_{i:06d}.xml")
+        with open(path, 'wb') as f:
+            f.write(synthetic_invoice_xml(f"BENCH-{i}", payload))
+        paths.append(path)
+    return paths
+
+
+def _benchmark_root() -> str:
+    """Pick a tmpfs-backed scratch directory when available"""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    import tempfile
+    return tempfile.gettempdir()
+
+
+@contextlib.contextmanager
+def quiet_console_logging():
+    """Send log output to the null device, so terminal speed doesn't skew timings"""
+    root_logger = logging.getLogger()
+    saved_handlers = root_logger.handlers[:]
+    saved_level = root_logger.level
+    null_stream = open(os.devnull, 'w')
+    for handler in saved_handlers:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.StreamHandler(null_stream))
+    root_logger.setLevel(logging.INFO)
+    try:
+        yield
+    finally:
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+        for handler in saved_handlers:
+            root_logger.addHandler(handler)
+        root_logger.setLevel(saved_level)
+        null_stream.close()
+
+
+def run_benchmark(file_count: int = 500, size_kb: int = 20) -> Dict[str, float]:
+    """Measure fixed per-file overhead of PeppolConverter.process_file by stage
+    
+    Args:
+        file_count: Number of synthetic invoices per measurement
+        size_kb: Approximate size of each synthetic invoice
+        
+    Returns:
+        Dict mapping measurement name to mean microseconds per file
+    """
+    import tempfile
+    work_dir = tempfile.mkdtemp(prefix="xmltopdf_bench_", dir=_benchmark_root())
+    results = {}
+    root_logger = logging.getLogger()
+    
+    def per_file_us(func, count):
+        started = time.perf_counter()
+        for i in range(count):
+            func(i)
+        return (time.perf_counter() - started) / count * 1e6
+    
+    try:
+        config = ConfigManager(os.path.join(work_dir, "config.json"))
+        config.config.update({
+            "output_directory": os.path.join(work_dir, "output"),
+            "failed_directory": os.path.join(work_dir, "failed"),
+            "log_directory": os.path.join(work_dir, "logs"),
+            "log_successful_files": True
+        })
+        log_manager = LogManager(config)
+        with quiet_console_logging():
+            converter = PeppolConverter(config)
+            converter.set_log_manager(log_manager)
+            output_dir = config.get("output_directory")
+            
+            # Isolated fixed costs, one operation per simulated file
+            results["logging.info (emitted)"] = per_file_us(
+                lambda i: logging.info(f"Processing bench_{i:06d}.xml"), file_count)
+            results["logging.debug (level-gated)"] = per_file_us(
+                lambda i: root_logger.isEnabledFor(logging.DEBUG) and logging.debug(f"Processing bench_{i:06d}.xml"),
+                file_count)
+            results["config lookups"] = per_file_us(
+                lambda i: (config.get("output_directory"), config.get("failed_directory")), file_count)
+            results["namespace registration"] = per_file_us(
+                lambda i: [ET.register_namespace(prefix, uri) for prefix, uri in NAMESPACES.items()], file_count)
+            os.makedirs(output_dir, exist_ok=True)
+            results["directory creation (exist_ok)"] = per_file_us(
+                lambda i: os.makedirs(output_dir, exist_ok=True), file_count)
+            results["log entry (queued)"] = per_file_us(
+                lambda i: log_manager.log_success(f"bench_{i:06d}.xml"), file_count)
+            log_manager.flush()
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            results["log file open/append"] = per_file_us(
+                lambda i: log_manager._write_entry(timestamp, "VEIKSMĪGI", f"bench_{i:06d}.xml", "-"), file_count)
+            
+            move_src = os.path.join(work_dir, "move_src")
+            move_dst = os.path.join(work_dir, "move_dst")
+            os.makedirs(move_dst, exist_ok=True)
+            move_files = write_synthetic_invoices(move_src, file_count, size_kb * 1024)
+            results["move"] = per_file_us(
+                lambda i: shutil.move(move_files[i], os.path.join(move_dst, os.path.basename(move_files[i]))),
+                file_count)
+            
+            # End-to-end batch with the converter's own stage breakdown
+            batch_files = write_synthetic_invoices(os.path.join(work_dir, "input"), file_count, size_kb * 1024)
+            stats = converter.process_batch(batch_files, interactive=False, lane="bulk")
+            for stage, timing in stats["stage_timings"].items():
+                results[f"process_file stage: {stage}"] = timing["total_seconds"] / file_count * 1e6
+            results["process_file total"] = stats["elapsed_seconds"] / file_count * 1e6
+            
+            # Parser backends on the same files, flat and with line-wrapped payloads
+            parser_throughput = {}
+            for kind, wrap in (("flat", False), ("wrapped", True)):
+                parse_dir = os.path.join(work_dir, f"parse_{kind}")
+                os.makedirs(parse_dir)
+                parse_files = []
+                for i in range(min(file_count, 50)):
+                    path = os.path.join(parse_dir, f"parse_{i:06d}.xml")
+                    with open(path, 'wb') as f:
+                        f.write(synthetic_invoice_xml(f"PARSE-{i}", synthetic_payload(size_kb * 1024), wrap))
+                    parse_files.append(path)
+                megabytes = sum(os.path.getsize(path) for path in parse_files) / (1024 * 1024)
+                for name, backend in PARSER_BACKENDS.items():
+                    if not backend.available():
+                        continue
+                    parser = backend()
+                    micros = per_file_us(lambda i: parser.parse(parse_files[i % len(parse_files)]), file_count)
+                    results[f"parser '{name}' ({kind})"] = micros
+                    parser_throughput[(name, kind)] = megabytes / len(parse_files) / (micros / 1e6)
+            
+            # Throughput cost of each durability mode for the writer stage
+            for mode in DURABILITY_MODES:
+                config.config["durability_mode"] = mode
+                mode_files = write_synthetic_invoices(os.path.join(work_dir, f"input_{mode}"), file_count, size_kb * 1024)
+                stats = converter.process_batch(mode_files, interactive=False, lane="bulk")
+                sync_seconds = sum(stats["stage_timings"].get(stage, {}).get("total_seconds", 0)
+                                   for stage in ("fsync", "batch_sync"))
+                results[f"durability '{mode}' total"] = stats["elapsed_seconds"] / file_count * 1e6
+                results[f"durability '{mode}' sync"] = sync_seconds / file_count * 1e6
+            log_manager.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print(f"Per-file overhead, {file_count} files of ~{size_kb} KB in {_benchmark_root()}:")
+    for name, micros in results.items():
+        print(f"  {name:<40} {micros:10.1f} µs")
+    print("XML parser throughput (relative to etree):")
+    for (name, kind), throughput in parser_throughput.items():
+        relative = throughput / parser_throughput[("etree", kind)]
+        print(f"  {name + ' (' + kind + ')':<40} {throughput:8.1f} MB/s {relative:6.2f}x")
+    return results
+
+
+def load_trace(trace_file: str) -> List[Dict]:
+    """Read a trace into its batches in arrival order, each with its file records and end record"""
+    batches = {}
+    with open(trace_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn last line of a trace whose process died
+            kind = record.get("type")
+            if kind == "batch":
+                record["files"], record["end"] = [], None
+                batches[record["batch"]] = record
+            elif kind == "file" and record["batch"] in batches:
+                batches[record["batch"]]["files"].append(record)
+            elif kind == "batch_end" and record["batch"] in batches:
+                batches[record["batch"]]["end"] = record
+    return sorted(batches.values(), key=lambda batch: batch["offset"])
+
+
+def replay_invoice_xml(seq: int, size: int, category: Optional[str] = None) -> bytes:
+    """Synthetic invoice of a recorded size that fails the way the recorded file did"""
+    xml = synthetic_invoice_xml(f"REPLAY-{seq}", synthetic_payload(size))
+    if category == "xml":
+        return xml[:len(xml) // 2]
+    if category == "missing_attachment":
+        return xml.replace(b"EmbeddedDocumentBinaryObject", b"ExternalReferenceBinaryData")
+    return xml
+
+
+def run_replay(trace_file: str, speed: float = 1.0) -> int:
+    """Replay a recorded trace against the converter with synthetic files
+    
+    Every batch is regenerated with files of the recorded sizes, failing the
+    same way where the recorded file failed with an xml or missing_attachment
+    error, and starts at its recorded offset under the settings it ran with.
+    Transient errors and claims taken by other instances are not reproduced.
+    
+    Batches share one converter, as they did in production, so settings are
+    only switched while no batch is running. A batch that overlaps an earlier
+    one runs with the settings already in effect; the report counts these.
+    
+    Args:
+        trace_file: Trace written by TraceRecorder
+        speed: Arrival time scale; 2 replays twice as fast, 0 starts batches back to back
+        
+    Returns:
+        Process exit code
+    """
+    import tempfile
+    batches = load_trace(trace_file)
+    if not batches:
+        logging.error(f"No batches found in trace {trace_file}")
+        return 1
+    work_dir = tempfile.mkdtemp(prefix="xmltopdf_replay_", dir=_benchmark_root())
+    results = {}
+    
+    try:
+        # Generate everything up front so file creation is not part of the replay
+        inputs = []
+        for batch in batches:
+            failures = {}
+            for record in batch["files"]:
+                if record["outcome"] == "failed":
+                    failures[record["seq"]] = record["category"]
+                elif record["outcome"] == "success":
+                    failures.pop(record["seq"], None)
+            directory = os.path.join(work_dir, f"batch_{batch['batch']:05d}")
+            os.makedirs(directory)
+            paths = []
+            for seq, size in enumerate(batch["sizes"]):
+                path = os.path.join(directory, f"replay_{seq:06d}.xml")
+                with open(path, 'wb') as f:
+                    f.write(replay_invoice_xml(seq, size, failures.get(seq)))
+                paths.append(path)
+            inputs.append(paths)
+        
+        config = ConfigManager(os.path.join(work_dir, "config.json"))
+        config.config.update({
+            "output_directory": os.path.join(work_dir, "output"),
+            "failed_directory": os.path.join(work_dir, "failed"),
+            "log_directory": os.path.join(work_dir, "logs"),
+            "batch_report_format": "",
+            "trace_directory": ""
+        })
+        log_manager = LogManager(config)
+        with quiet_console_logging():
+            converter = PeppolConverter(config)
+            converter.set_log_manager(log_manager)
+            
+            def replay_batch(batch, paths):
+                results[batch["batch"]] = converter.process_batch(paths, interactive=False, lane=batch["lane"])
+            
+            # Batches that overlapped in production overlap here too
+            threads = []
+            settings_kept = 0
+            first_offset = batches[0]["offset"]
+            replay_started = time.perf_counter()
+            for batch, paths in zip(batches, inputs):
+                if speed > 0:
+                    delay = replay_started + (batch["offset"] - first_offset) / speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                changed = any(config.config.get(key) != value for key, value in batch["settings"].items())
+                if changed and any(thread.is_alive() for thread in threads):
+                    # Running batches read the config as they go; switching it would change them too
+                    settings_kept += 1
+                elif changed:
+                    config.config.update(batch["settings"])
+                thread = threading.Thread(target=replay_batch, args=(batch, paths), name=f"replay-{batch['batch']}")
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            replay_elapsed = time.perf_counter() - replay_started
+            converter.shutdown()
+            log_manager.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    recorded_stages, replayed_stages = {}, {}
+    print(f"Replay of {trace_file}: {len(batches)} batches, "
+          f"{sum(len(batch['sizes']) for batch in batches)} files in {replay_elapsed:.2f} s")
+    if settings_kept:
+        print(f"  {settings_kept} batches overlapped a running batch and kept its settings instead of their recorded ones")
+    print(f"  {'batch':>6} {'lane':<12} {'files':>7} {'recorded s':>11} {'replayed s':>11} {'failed':>7} {'replayed':>8}")
+    for batch in batches:
+        end = batch["end"] or {}
+        stats = results.get(batch["batch"], {})
+        recorded = f"{end['elapsed']:.3f}" if "elapsed" in end else "-"
+        replayed = f"{stats['elapsed_seconds']:.3f}" if stats else "-"
+        print(f"  {batch['batch']:>6} {batch['lane']:<12} {len(batch['sizes']):>7} {recorded:>11} {replayed:>11} "
+              f"{end.get('failed', '-'):>7} {stats.get('failed', '-'):>8}")
+        for stage, seconds in end.get("stages", {}).items():
+            recorded_stages[stage] = recorded_stages.get(stage, 0.0) + seconds
+        for stage, timing in stats.get("stage_timings", {}).items():
+            replayed_stages[stage] = replayed_stages.get(stage, 0.0) + timing["total_seconds"]
+    print(f"  {'stage':<20} {'recorded s':>11} {'replayed s':>11}")
+    for stage in sorted(set(recorded_stages) | set(replayed_stages),
+                        key=lambda name: -max(recorded_stages.get(name, 0.0), replayed_stages.get(name, 0.0))):
+        print(f"  {stage:<20} {recorded_stages.get(stage, 0.0):>11.3f} {replayed_stages.get(stage, 0.0):>11.3f}")
+    return 0
+
+
+def list_input_files(directory: str) -> List[str]:
+    """List XML files directly inside a directory with a single scandir"""
+    with os.scandir(directory) as entries:
+        return sorted(entry.path for entry in entries
+                      if entry.name.lower().endswith('.xml') and entry.is_file())
+
+
+def run_headless(config_file: str = "config.json", watch_interval: float = 0) -> int:
+    """Convert the configured input directory without the GUI
+    
+    Args:
+        config_file: Path to the configuration file
+        watch_interval: Seconds between directory scans; 0 processes the directory once
+        
+    Returns:
+        Process exit code
+    """
+    config_manager = ConfigManager(config_file)
+    log_manager = LogManager(config_manager)
+    converter = PeppolConverter(config_manager)
+    converter.set_log_manager(log_manager)
+    
+    input_dir = config_manager.get("input_directory")
+    if not input_dir or not os.path.isdir(input_dir):
+        logging.error(f"Input directory not configured or missing: '{input_dir}'")
+        return 1
+    
+    # Announce ourselves in the input directory like the GUI does. Batches can outlast
+    # ACTIVE_SECONDS, so the record is kept fresh by a thread independent of the loop
+    lock_manager = DirectoryLockManager()
+    lock_manager.start_heartbeat((input_dir,))
+    
+    try:
+        while True:
+            changed = config_manager.reload_if_changed()
+            if {"log_directory", "log_max_size_mb", "log_max_lines", "log_successful_files"} & set(changed):
+                log_manager.update_log_path()
+                log_manager.update_config(config_manager.get("log_max_size_mb", 10),
+                                          config_manager.get("log_max_lines", 10000),
+                                          config_manager.get("log_successful_files", False))
+            new_input_dir = config_manager.get("input_directory")
+            if new_input_dir != input_dir:
+                if new_input_dir and os.path.isdir(new_input_dir):
+                    logging.info(f"Input directory changed to '{new_input_dir}'")
+                    lock_manager.release_directory_lock(input_dir)
+                    success, msg = lock_manager.try_lock_directory(new_input_dir)
+                    if msg:
+                        logging.info(msg)
+                    input_dir = new_input_dir
+                else:
+                    logging.error(f"Configured input directory missing, keeping '{input_dir}': '{new_input_dir}'")
+            converter.heartbeat_claims()
+            for claimer in converter.claimers.values():
+                claimer.recover_stale_claims()
+            files = list_input_files(input_dir)
+            if files:
+                converter.process_batch(files, interactive=False)
+            if not watch_interval:
+                break
+            time.sleep(watch_interval)
+    except KeyboardInterrupt:
+        logging.info("Headless conversion stopped")
+    finally:
+        converter.shutdown()
+        lock_manager.release_all_locks()
+        log_manager.close()
+    return 0
+
+
+def run_reprocess_failed(config_file: str, categories: Optional[List[str]] = None,
+                         changed: bool = False, list_only: bool = False) -> int:
+    """Reprocess selected files from the failed directory using its failure index
+    
+    Args:
+        config_file: Path to the configuration file
+        categories: Only files whose error class is one of these
+        changed: Also files whose content changed since they failed
+        list_only: Print the selected files and their index entries instead
+        
+    Returns:
+        Process exit code
+    """
+    config_manager = ConfigManager(config_file)
+    failed_dir = config_manager.get("failed_directory")
+    if not failed_dir or not os.path.isdir(failed_dir):
+        logging.error(f"Failed directory not configured or missing: '{failed_dir}'")
+        return 1
+    index = FailureIndex(os.path.abspath(failed_dir))
+    files = index.select(categories, changed)
+    
+    if list_only:
+        entries = index.entries()
+        for path in files:
+            name = os.path.basename(path)
+            print(json.dumps(entries.get(name, {"file": name, "category": "unknown"}), ensure_ascii=False))
+        return 0
+    
+    log_manager = LogManager(config_manager)
+    converter = PeppolConverter(config_manager)
+    converter.set_log_manager(log_manager)
+    converter.failure_index = index
+    logging.info(f"Reprocessing {len(files)} of the files in {failed_dir}")
+    try:
+        if files:
+            converter.process_batch(files, interactive=False)
+    finally:
+        converter.shutdown()
+        log_manager.close()
+    
+    # Converted files left the directory; files that failed again were re-indexed
+    for path in files:
+        if not os.path.exists(path):
+            index.resolve(os.path.basename(path))
+    index.compact()
+    return 0
+
+
+def create_gui_root():
+    """Create the Tk root window, with drag and drop when TkinterDnD2 is installed"""
+    # Try to load TkDND
+    try:
+        from tkinterdnd2 import TkinterDnD, DND_FILES
+        root = TkinterDnD.Tk()
+        # For convenience, store the constant
+        root.dnd_files = DND_FILES
+    except ImportError as e:
+        root = tk.Tk()
+        logging.warning(f"TkinterDnD2 not available, drag and drop will not work: {str(e)}")
+        # Show warning message once the main window is up instead of delaying it
+        root.after(0, lambda: messagebox.showwarning(
+            "Missing Dependency", 
+            "TkinterDnD2 module not found. Drag and drop functionality will not be available.\n\n"
+            "To enable drag and drop, install it with:\npip install tkinterdnd2"
+        ))
+    return root
+
+
+def run_startup_probe(mode: str, config_file: str, started: float) -> int:
+    """Start the application up to the point where it is ready, then shut it down
+    
+    Run by run_startup_report in a child process; prints the time spent in
+    application initialisation after main() was entered as JSON.
+    """
+    if mode == "gui":
+        root = create_gui_root()
+        app = ConverterGUI(root)
+        root.update()  # Draw the first frame
+        ready = time.perf_counter()
+        app.on_exit()
+    else:
+        config_manager = ConfigManager(config_file)
+        log_manager = LogManager(config_manager)
+        converter = PeppolConverter(config_manager)
+        converter.set_log_manager(log_manager)
+        ready = time.perf_counter()
+        converter.shutdown()
+        log_manager.close()
+    print(json.dumps({"init_ms": (ready - started) * 1000}))
+    return 0
+
+
+def run_startup_report(mode: str, config_file: str, budget_ms: float = 0, top: int = 15) -> int:
+    """Measure GUI or headless startup with an -X importtime breakdown
+    
+    Args:
+        mode: "gui" or "headless"
+        config_file: Configuration used by the started application
+        budget_ms: Startup time allowed; 0 only reports
+        top: Number of slowest imports to list
+        
+    Returns:
+        Exit code: 0 within budget, 1 over budget, 2 if the application failed to start
+    """
+    import subprocess
+    
+    command = [sys.executable, "-X", "importtime", os.path.abspath(__file__),
+               "--startup-probe", mode, "--config", config_file]
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    total_ms = (time.perf_counter() - started) * 1000
+    
+    # Lines look like "import time:  self [us] | cumulative | <indented package>";
+    # top-level imports carry a single leading space
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # Header line
+        name = fields[2]
+        if name.startswith(" ") and not name.startswith("  "):
+            imports.append((int(fields[1]) / 1000, name.strip()))
+    
+    init_ms = None
+    for line in result.stdout.splitlines():
+        if line.startswith("{"):
+            init_ms = json.loads(line).get("init_ms")
+    if result.returncode != 0 or init_ms is None:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        print(f"Startup probe ({mode}) failed with exit code {result.returncode}:")
+        print("\n".join(errors[-20:]))
+        return 2
+    
+    import_ms = sum(ms for ms, _ in imports)
+    over = bool(budget_ms) and total_ms > budget_ms
+    verdict = f", budget {budget_ms:.0f} ms: {'OVER BUDGET' if over else 'OK'}" if budget_ms else ""
+    print(f"Startup ({mode}): {total_ms:.1f} ms total, {import_ms:.1f} ms in imports, "
+          f"{init_ms:.1f} ms from main() to ready{verdict}")
+    print(f"Slowest top-level imports (cumulative ms):")
+    for ms, name in sorted(imports, reverse=True)[:top]:
+        print(f"  {ms:8.1f}  {name}")
+    return 1 if over else 0
+
+
 # After the ConverterGUI class ends:
-def main():
+def main(argv=None):
     """Main entry point for the application"""
+    started = time.perf_counter()
+    parser = argparse.ArgumentParser(description="PEPPOL XML uz PDF konvertētājs")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="measure per-file fixed overhead on small synthetic invoices and exit")
+    parser.add_argument("--bench-files", type=int, default=500,
+                        help="number of synthetic invoices for --benchmark")
+    parser.add_argument("--bench-size-kb", type=int, default=20,
+                        help="approximate size of each synthetic invoice for --benchmark")
+    parser.add_argument("--replay", metavar="TRACE",
+                        help="replay a batch trace recorded via trace_directory with synthetic files and exit")
+    parser.add_argument("--replay-speed", type=float, default=1.0, metavar="FACTOR",
+                        help="arrival time scale for --replay; 0 starts recorded batches back to back")
+    parser.add_argument("--headless", action="store_true",
+                        help="convert the configured input directory without the GUI")
+    parser.add_argument("--watch", type=float, default=0, metavar="SECONDS",
+                        help="with --headless, keep scanning the input directory at this interval")
+    parser.add_argument("--config", default="config.json",
+                        help="configuration file (default: config.json)")
+    parser.add_argument("--find", metavar="FIELD=VALUE",
+                        help="look up invoices in the metadata index, e.g. invoice_id=INV-1 or "
+                             "supplier_name=%%Acme%% (%% is a wildcard), and exit")
+    parser.add_argument("--extract", metavar="NAME",
+                        help="extract one archived invoice (e.g. invoice.pdf) from the output directory and exit")
+    parser.add_argument("--extract-to", default=".", metavar="DIR",
+                        help="directory for --extract (default: current directory)")
+    parser.add_argument("--reprocess-failed", action="store_true",
+                        help="convert files from the failed directory again and exit; "
+                             "narrow the selection with --error-class and/or --changed-only")
+    parser.add_argument("--list-failed", action="store_true",
+                        help="print the failure index entries of the selected failed files and exit")
+    parser.add_argument("--error-class", action="append", metavar="CLASS",
+                        help="with --reprocess-failed/--list-failed, select files that failed with this error "
+                             "class (e.g. io, xml, missing_attachment, unknown); repeatable or comma separated")
+    parser.add_argument("--changed-only", action="store_true",
+                        help="with --reprocess-failed/--list-failed, select files whose content changed since they failed")
+    parser.add_argument("--startup-report", choices=("gui", "headless"),
+                        help="start the application in a child process with -X importtime, "
+                             "report where startup time goes and exit non-zero when over budget")
+    parser.add_argument("--startup-budget-ms", type=float, default=0, metavar="MS",
+                        help="budget for --startup-report (default: startup_budget_ms in the configuration)")
+    parser.add_argument("--startup-probe", choices=("gui", "headless"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    
+    if args.find:
+        config_manager = ConfigManager(args.config)
+        index_path = config_manager.get("metadata_index_path")
+        if not index_path or "=" not in args.find:
+            parser.error("--find needs FIELD=VALUE and metadata_index_path in the configuration")
+        field, value = args.find.split("=", 1)
+        index = MetadataIndex(os.path.abspath(index_path))
+        for result in index.find(field, value):
+            print(json.dumps(result, ensure_ascii=False))
+        index.close()
+        return
+    
+    if args.extract:
+        config_manager = ConfigManager(args.config)
+        data = extract_archived_invoice(config_manager.get("output_directory"), args.extract)
+        with open(os.path.join(args.extract_to, os.path.basename(args.extract)), 'wb') as f:
+            f.write(data)
+        return
+    
+    if args.benchmark:
+        run_benchmark(args.bench_files, args.bench_size_kb)
+        return
+    
+    if args.replay:
+        sys.exit(run_replay(args.replay, args.replay_speed))
+    
+    if args.headless:
+        sys.exit(run_headless(args.config, args.watch))
+    
+    if args.reprocess_failed or args.list_failed:
+        categories = [name.strip() for value in (args.error_class or []) for name in value.split(",") if name.strip()]
+        sys.exit(run_reprocess_failed(args.config, categories, args.changed_only, list_only=args.list_failed))
+    
+    if args.startup_report:
+        budgets = ConfigManager(args.config).get("startup_budget_ms") or {}
+        budget_ms = args.startup_budget_ms or budgets.get(args.startup_report, 0)
+        sys.exit(run_startup_report(args.startup_report, args.config, budget_ms))
+    
+    if args.startup_probe:
+        sys.exit(run_startup_probe(args.startup_probe, args.config, started))
+    
     try:
-        # Try to load TkDND
-        try:
-            from tkinterdnd2 import TkinterDnD, DND_FILES
-            root = TkinterDnD.Tk()
-            # For convenience, store the constant
-            root.dnd_files = DND_FILES
-        except ImportError as e:
-            root = tk.Tk()
-            logging.warning(f"TkinterDnD2 not available, drag and drop will not work: {str(e)}")
-            # Show warning message
-            messagebox.showwarning(
-                "Missing Dependency", 
-                "TkinterDnD2 module not found. Drag and drop functionality will not be available.\n\n"
-                "To enable drag and drop, install it with:\npip install tkinterdnd2"
-            )
+        root = create_gui_root()
         
         # Create and start application
         app = ConverterGUI(root)